@@ -0,0 +1,419 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Optional
+import urllib.parse
+
+try:
+    import aiohttp
+except ImportError:  # Optional, nur für die asynchronen Clients nötig
+    aiohttp = None
+
+from churchtools_api import Churchtools_API, ChurchtoolsApiError, CustomEncoder
+from custom_types import CT_Song
+from http_client import Retry_Policy, default_rate_limiter
+from instrumentation import default_instrumentation
+from telegram import send_telegram_message
+from token_store import Token_Store
+from worshiptools_api import Worshiptools_API, WorshiptoolsApiError
+
+REQUEST_TIMEOUT = 30
+RETRY_EXCEPTIONS = (aiohttp.ClientConnectionError, asyncio.TimeoutError) if aiohttp else ()
+
+
+def _require_aiohttp():
+    if aiohttp is None:
+        raise RuntimeError("Die asynchronen Clients benötigen das Paket aiohttp (pip install aiohttp)")
+
+
+class Async_Response:
+    """Bereits gelesene Antwort mit derselben Oberfläche wie requests.Response (status_code, headers, text, json())."""
+
+    def __init__(self, status_code: int, headers, text: str):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+async def _read_response(method: str, url: str, response, started: float, bytes_sent: int) -> Async_Response:
+    """Liest die Antwort und erfasst sie wie Pooled_Adapter in der default_instrumentation."""
+    text = await response.text()
+    default_instrumentation.record_http(
+        method, url, response.status, time.perf_counter() - started, bytes_sent, len(text.encode("utf-8"))
+    )
+    return Async_Response(response.status, response.headers, text)
+
+
+class Async_Churchtools_API:
+    """
+    Asynchrones Gegenstück zu Churchtools_API (gleiche Methoden, aber mit await).
+    Höchstens max_concurrency Anfragen laufen gleichzeitig, egal wie viele Coroutinen Anfragen stellen.
+    Benötigt das optionale Paket aiohttp.
+
+    Verwendung:
+        async with Async_Churchtools_API(base_url, ct_token) as ct_api:
+            songs = await ct_api.get_all("songs", {"limit": 100})
+    """
+
+    max_concurrency = 10
+    notify = True
+    retry_policy = Retry_Policy()
+    rate_limiter = default_rate_limiter
+    # Wie bei Churchtools_API, damit CSRF Token und Positionsangaben in beiden Clients gleich behandelt werden
+    _csrf_token_name = Churchtools_API._csrf_token_name
+    _position_params = Churchtools_API._position_params
+
+    def __init__(
+        self,
+        base_url: str,
+        ct_token: Optional[str] = None,
+        ct_user: Optional[str] = None,
+        ct_password: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        token_store: Optional[Token_Store] = None,
+    ):
+        _require_aiohttp()
+        if not base_url:
+            raise ChurchtoolsApiError("CHURCHTOOLS_BASE_URL is required")
+        if not ct_token and not (ct_user and ct_password):
+            raise ChurchtoolsApiError("ChurchTools login token or username/password is required")
+        self.base_url = base_url
+        self.ct_token = ct_token
+        self.ct_user = ct_user
+        self.ct_password = ct_password
+        self.token_store = token_store
+        if max_concurrency is not None:
+            self.max_concurrency = max_concurrency
+        self.session: "aiohttp.ClientSession | None" = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._login_lock = asyncio.Lock()
+        self._csrf_refreshed_session: "aiohttp.ClientSession | None" = None
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def login(self):
+        if self.session:
+            await self.session.close()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+        )
+        if self.ct_token:
+            logging.info("Trying Login with token")
+            response = await self._send_once(
+                "get", f"{self.base_url}/api/whoami", headers={"Authorization": "Login " + self.ct_token}
+            )
+        else:
+            logging.info("Trying Login with Username/Password")
+            data = {"username": self.ct_user, "password": self.ct_password}
+            response = await self._send_once("post", f"{self.base_url}/api/login", data=data)
+        if response.status_code != 200:
+            raise ChurchtoolsApiError(f"ChurchTools login failed: {response.status_code}, {response.text}")
+        logging.info("ChurchTools Login Successful")
+        self.session.headers["CSRF-Token"] = await self._csrf_token()
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def get(self, endpoint: str, params=None):
+        api_url = self._api_url(endpoint, params)
+        logging.info(f"GET {api_url}")
+        response = await self._request("get", api_url)
+        if response.status_code == 200:
+            return response.json()
+        logging.error(f"Fehler bei der API-Anfrage: {response.status_code}, {response.text}")
+        return None
+
+    async def get_all(self, endpoint: str, params: dict | None = None):
+        """Lädt alle Seiten eines paginierten Endpunkts, nach der ersten Seite alle übrigen gleichzeitig."""
+        params = dict(params or {})
+        first_page = await self._get_page(endpoint, params, 1)
+        last_page = first_page["meta"]["pagination"]["lastPage"]
+        pages = await asyncio.gather(*(self._get_page(endpoint, params, page) for page in range(2, last_page + 1)))
+        data = list(first_page["data"])
+        for res in pages:
+            data.extend(res["data"])
+        return {"data": data}
+
+    async def post(self, endpoint: str, data, params=None):
+        api_url = self._api_url(endpoint, params)
+        json_data = json.dumps(data, cls=CustomEncoder)
+        logging.info(f"POST {api_url}\n{json_data}")
+        response = await self._request("post", api_url, data=json_data, headers={"Content-Type": "application/json"})
+        if response.status_code in (200, 201):
+            return response.json()
+        logging.error(f"Fehler bei der API-Anfrage: {response.status_code}, {response.text}")
+        return None
+
+    async def put(self, endpoint: str, data, params=None):
+        api_url = self._api_url(endpoint, params)
+        json_data = json.dumps(data, cls=CustomEncoder)
+        logging.info(f"PUT {api_url}\n{json_data}")
+        response = await self._request("put", api_url, data=json_data, headers={"Content-Type": "application/json"})
+        if response.status_code in (200, 201):
+            return response.json()
+        logging.error(f"Fehler bei der API-Anfrage: {response.status_code}, {response.text}")
+        return None
+
+    async def create_song(self, name: str, categoryId: int, author=None, copyright=None, ccli=None):
+        """Method to create a new song and add arrangement"""
+        data = {"name": name, "categoryId": categoryId, "author": author, "copyright": copyright, "ccli": ccli}
+        response = await self.post("songs", data)
+        if not response:
+            logging.info("Creating song failed")
+            return None
+
+        new_song: CT_Song = response["data"]
+        logging.debug("Song created successful with ID=%s", new_song["id"])
+        if self.notify:
+            await asyncio.to_thread(
+                send_telegram_message,
+                f"""*Neuer Song*
+{new_song['name']}, {new_song['author']}
+https://songselect.ccli.com/songs/{new_song['ccli']}""",
+            )
+
+        a_response = await self.post(f"songs/{new_song['id']}/arrangements", {"name": "Standard-Arrangement"})
+        if not a_response:
+            logging.info("Creating default arrangement failed for song ID=%s", new_song["id"])
+            return None
+
+        new_song["arrangements"].append(a_response["data"])
+        return new_song
+
+    async def create_agenda_item(
+        self, event_id: int, item: dict, before_id: int | None = None, after_id: int | None = None
+    ):
+        params = self._position_params(before_id, after_id)
+        return await self.post(f"events/{event_id}/agenda/items", item, params=params)
+
+    async def update_agenda_item(
+        self, event_id: int, item_id: int, item: dict, before_id: int | None = None, after_id: int | None = None
+    ):
+        params = self._position_params(before_id, after_id)
+        return await self.put(f"events/{event_id}/agenda/items/{item_id}", item, params=params)
+
+    async def _get_page(self, endpoint: str, params: dict, page: int):
+        res = await self.get(endpoint, {**params, "page": page})
+        if not res:
+            raise ChurchtoolsApiError(f"ChurchTools API request failed for {endpoint} page {page}")
+        if "meta" not in res or "pagination" not in res["meta"] or "data" not in res:
+            raise ChurchtoolsApiError(f"ChurchTools API response missing pagination metadata for {endpoint}")
+        return res
+
+    async def _csrf_token(self, reuse: bool = True):
+        """Wie Churchtools_API._csrf_token: gespeicherter Token, sonst neu abrufen und speichern."""
+        csrf_token = self.token_store.get(self._csrf_token_name()) if self.token_store and reuse else None
+        if csrf_token:
+            return csrf_token
+        response = await self._send_once("get", f"{self.base_url}/api/csrftoken")
+        if response.status_code != 200:
+            raise ChurchtoolsApiError(f"CSRF Token request failed: {response.status_code}, {response.text}")
+        csrf_token = response.json()["data"]
+        if self.token_store:
+            self.token_store.save(self._csrf_token_name(), csrf_token)
+        return csrf_token
+
+    async def _request(self, method: str, url: str, **kwargs) -> Async_Response:
+        """
+        Sendet die Anfrage (mit Retry und Rate Limit), meldet sich bei 401 einmalig neu an und ruft bei 403 auf
+        einen Schreibzugriff einmal je Session einen neuen CSRF Token ab (der gespeicherte gehört zu einer alten Session).
+        """
+        session = self.session
+        csrf_token = session.headers.get("CSRF-Token")
+        response = await self._send(method, url, **kwargs)
+        if response.status_code == 401:
+            async with self._login_lock:
+                if self.session is session:
+                    logging.info("ChurchTools Session abgelaufen, melde neu an")
+                    if self.token_store:
+                        self.token_store.delete(self._csrf_token_name())
+                    await self.login()
+            response = await self._send(method, url, **kwargs)
+        elif response.status_code == 403 and method != "get" and await self._refresh_csrf_token(session, csrf_token):
+            response = await self._send(method, url, **kwargs)
+        return response
+
+    async def _refresh_csrf_token(self, session, rejected_token: str | None) -> bool:
+        async with self._login_lock:
+            if self.session is not session or self.session.headers.get("CSRF-Token") != rejected_token:
+                return True
+            if rejected_token is None or self._csrf_refreshed_session is session:
+                return False
+            logging.info("CSRF Token abgelehnt, rufe einen neuen ab")
+            self._csrf_refreshed_session = session
+            self.session.headers["CSRF-Token"] = await self._csrf_token(reuse=False)
+            return True
+
+    async def _send(self, method: str, url: str, **kwargs) -> Async_Response:
+        return await self.retry_policy.send_async(
+            method, url, lambda: self._send_once(method, url, **kwargs), self.rate_limiter, RETRY_EXCEPTIONS
+        )
+
+    async def _send_once(self, method: str, url: str, **kwargs) -> Async_Response:
+        data = kwargs.get("data")
+        bytes_sent = len(data.encode("utf-8")) if isinstance(data, str) else 0
+        async with self._semaphore:
+            started = time.perf_counter()
+            async with self.session.request(method, url, **kwargs) as response:
+                return await _read_response(method, url, response, started, bytes_sent)
+
+    def _api_url(self, endpoint: str, params=None):
+        params_str = "?" + urllib.parse.urlencode(params) if params else ""
+        return f"{self.base_url}/api/{endpoint}{params_str}"
+
+
+class Async_Worshiptools_API:
+    """
+    Asynchrones Gegenstück zu Worshiptools_API (get, get_all mit await). Benötigt das optionale Paket aiohttp.
+
+    Verwendung:
+        async with Async_Worshiptools_API(email, password, account_id) as wt_api:
+            songs = await wt_api.get_all("song", {"rows": 100})
+    """
+
+    max_concurrency = 10
+    max_pagination_attempts = Worshiptools_API.max_pagination_attempts
+    retry_policy = Retry_Policy()
+    rate_limiter = default_rate_limiter
+    app_url = Worshiptools_API.app_url
+    login_url = Worshiptools_API.login_url
+    api_url = Worshiptools_API.api_url
+    # Wie bei Worshiptools_API, damit gespeicherte Tokens und Header in beiden Clients gleich sind
+    _token_name = Worshiptools_API._token_name
+    _api_headers = Worshiptools_API._api_headers
+    _origin = Worshiptools_API._origin
+
+    def __init__(
+        self,
+        email,
+        password,
+        account_id,
+        max_concurrency: Optional[int] = None,
+        token_store: Optional[Token_Store] = None,
+        app_url: str | None = None,
+        login_url: str | None = None,
+        api_url: str | None = None,
+    ):
+        _require_aiohttp()
+        if not email or not password or not account_id:
+            raise WorshiptoolsApiError("WORSHIPTOOLS_EMAIL, WORSHIPTOOLS_PASSWORD, and WORSHIPTOOLS_ACCOUNT_ID are required")
+        self.email = email
+        self.password = password
+        self.account_id = account_id
+        self.token_store = token_store
+        if max_concurrency is not None:
+            self.max_concurrency = max_concurrency
+        self.app_url = app_url or self.app_url
+        self.login_url = login_url or self.login_url
+        self.api_url = api_url or self.api_url
+        self.session: "aiohttp.ClientSession | None" = None
+        self.bearer_token: str | None = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._login_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:132.0) Gecko/20100101 Firefox/132.0"},
+        )
+        self.bearer_token = self.token_store.get(self._token_name()) if self.token_store else None
+        if self.bearer_token:
+            logging.info(f"Worshiptools Login als {self.email} aus gespeichertem Token")
+        else:
+            await self.login()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def login(self):
+        async with self.session.get(self.app_url, allow_redirects=True) as response:
+            if response.status not in [200, 302]:
+                raise WorshiptoolsApiError(
+                    f"Fehler beim Abrufen von authRequest oder weAuthState: {response.status}, {await response.text()}"
+                )
+        data = {"email": self.email, "password": self.password}
+        async with self.session.post(self.login_url, data=data, allow_redirects=True) as response:
+            if response.status not in [200, 302]:
+                raise WorshiptoolsApiError(f"Fehler beim Login: {response.status}, {await response.text()}")
+        self.bearer_token = next(
+            (cookie.value for cookie in self.session.cookie_jar if cookie.key == "weAuthToken"), None
+        )
+        if not self.bearer_token:
+            raise WorshiptoolsApiError("Worshiptools login did not return a bearer token")
+        logging.info(f"Worshiptools Login Successful as {self.email}")
+        if self.token_store:
+            self.token_store.save(self._token_name(), self.bearer_token)
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def get(self, endpoint: str, params: dict | None = None):
+        params_str = "?" + urllib.parse.urlencode(params) if params else ""
+        api_url = f"{self.api_url}/account/{self.account_id}/{endpoint}{params_str}"
+        logging.info(f"GET {api_url}")
+        bearer_token = self.bearer_token
+        response = await self._send(api_url, bearer_token)
+        if response.status_code == 401:
+            async with self._login_lock:
+                if self.bearer_token == bearer_token:
+                    logging.info("Worshiptools Token abgelaufen, melde neu an")
+                    await self.login()
+            response = await self._send(api_url, self.bearer_token)
+        if response.status_code == 200:
+            return response.json().get("response")
+        logging.error(f"Fehler bei der API-Anfrage: {response.status_code}, {response.text}")
+        return None
+
+    async def get_all(self, endpoint: str, params: dict | None = None):
+        """Lädt alle Seiten eines paginierten Endpunkts. Ändert sich numFound zwischendurch, wird neu geladen."""
+        params = dict(params or {})
+        for _ in range(self.max_pagination_attempts):
+            first_page = await self._get_page(endpoint, params, 0)
+            total_num = first_page["numFound"]
+            page_size = len(first_page["docs"])
+            offsets = range(page_size, total_num, page_size) if page_size else range(0)
+            pages = await asyncio.gather(*(self._get_page(endpoint, params, start) for start in offsets))
+            if all(res["numFound"] == total_num for res in pages):
+                data = list(first_page["docs"])
+                for res in pages:
+                    data.extend(res["docs"])
+                return {"docs": data}
+            logging.warning(f"numFound für {endpoint} hat sich während der Pagination geändert, lade erneut")
+        raise WorshiptoolsApiError(f"Worshiptools API pagination for {endpoint} did not settle")
+
+    async def _get_page(self, endpoint: str, params: dict, start: int):
+        res = await self.get(endpoint, {**params, "start": start})
+        if not res:
+            raise WorshiptoolsApiError("Fehler bei Anfrage an Worshiptools API")
+        if "numFound" not in res or "docs" not in res:
+            raise WorshiptoolsApiError(f"Worshiptools API response missing pagination metadata for {endpoint}")
+        return res
+
+    async def _send(self, api_url: str, bearer_token: str) -> Async_Response:
+        headers = self._api_headers(bearer_token)
+
+        async def send():
+            async with self._semaphore:
+                started = time.perf_counter()
+                async with self.session.get(api_url, headers=headers) as response:
+                    return await _read_response("GET", api_url, response, started, 0)
+
+        return await self.retry_policy.send_async("get", api_url, send, self.rate_limiter, RETRY_EXCEPTIONS)
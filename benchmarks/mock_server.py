@@ -0,0 +1,301 @@
+"""
+Lokaler Mock-Server für ChurchTools und Worshiptools, um komplette Sync-Läufe ohne Produktivsysteme zu testen.
+
+    python -m benchmarks.mock_server --port 8080 --songs 5000 --events 200 --latency 0.05 --error-rate 0.01
+
+Danach sync.py mit diesen Umgebungsvariablen starten (Zugangsdaten sind beliebig, müssen aber gesetzt sein):
+
+    CHURCHTOOLS_BASE_URL=http://127.0.0.1:8080
+    WORSHIPTOOLS_APP_URL=http://127.0.0.1:8080/wt/app
+    WORSHIPTOOLS_AUTH_URL=http://127.0.0.1:8080/wt/login
+    WORSHIPTOOLS_API_URL=http://127.0.0.1:8080/wt/v1
+
+Die Daten kommen aus benchmarks.synthetic und passen zur config.yaml des Repos.
+"""
+
+import argparse
+from datetime import datetime, timezone
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+from benchmarks import synthetic
+
+# Login-Endpunkte sind von den simulierten Fehlern ausgenommen, damit ein Lauf überhaupt starten kann
+LOGIN_HANDLERS = {"ct_whoami", "ct_login", "ct_csrftoken", "wt_app", "wt_login"}
+
+ROUTES: list[tuple[str, re.Pattern, str]] = [
+    (method, re.compile(pattern + r"$"), handler)
+    for method, pattern, handler in [
+        ("GET", r"/api/whoami", "ct_whoami"),
+        ("POST", r"/api/login", "ct_login"),
+        ("GET", r"/api/csrftoken", "ct_csrftoken"),
+        ("GET", r"/api/songs", "ct_songs"),
+        ("POST", r"/api/songs", "ct_create_song"),
+        ("POST", r"/api/songs/(\d+)/arrangements", "ct_create_arrangement"),
+        ("GET", r"/api/events", "ct_events"),
+        ("GET", r"/api/events/(\d+)/agenda", "ct_agenda"),
+        ("POST", r"/api/events/(\d+)/agenda/items", "ct_create_agenda_item"),
+        ("PUT", r"/api/events/(\d+)/agenda/items/(\d+)", "ct_update_agenda_item"),
+        ("GET", r"/wt/app", "wt_app"),
+        ("POST", r"/wt/login", "wt_login"),
+        ("GET", r"/wt/v1/account/[^/]+/song", "wt_songs"),
+        ("GET", r"/wt/v1/account/[^/]+/service", "wt_services"),
+    ]
+]
+
+
+class Mock_Dataset:
+    def __init__(self, songs: int = 1000, events: int = 100, agenda_items: int = 20, seed: int = 0):
+        """Veränderbarer Datenbestand beider Systeme, Schreibzugriffe des Syncs landen hier."""
+        self.lock = threading.Lock()
+        self.wt_songs = synthetic.wt_songs(songs)
+        self.ct_songs = synthetic.ct_songs(songs, seed=seed)
+        self.wt_services, self.ct_events = synthetic.calendar(events, songs, seed=seed)
+        self.agenda_items = agenda_items
+        self.agendas: dict[int, dict] = {}
+        self.next_id = 10_000_000 + songs
+
+    def new_id(self) -> int:
+        self.next_id += 1
+        return self.next_id
+
+    def agenda(self, event_id: int) -> dict:
+        if event_id not in self.agendas:
+            ct_agenda = synthetic.agenda(self.agenda_items)
+            for item in ct_agenda["items"]:
+                item["id"] = event_id * 1000 + item["id"]
+            self.agendas[event_id] = ct_agenda
+        return self.agendas[event_id]
+
+
+class Mock_Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        dataset: Mock_Dataset,
+        latency: float = 0,
+        error_rate: float = 0,
+        rate_limit_rate: float = 0,
+        retry_after: float = 1,
+        page_size: int = 25,
+        seed: int | None = None,
+    ):
+        """
+        latency: Sekunden Verzögerung je Anfrage (±50 % Jitter)
+        error_rate / rate_limit_rate: Anteil der Anfragen, die mit 503 bzw. 429 (mit Retry-After) beantwortet werden
+        page_size: Seitengröße, falls der Client kein limit/rows mitschickt
+        """
+        super().__init__(address, Mock_Handler)
+        self.dataset = dataset
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.requests: dict[str, int] = {}
+
+    def count(self, key: str):
+        with self.dataset.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+
+class Mock_Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: Mock_Server
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def log_message(self, *args):
+        pass
+
+    def _dispatch(self, method: str):
+        url = urllib.parse.urlsplit(self.path)
+        self.query = dict(urllib.parse.parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length) if length else b""
+        if self.server.latency:
+            time.sleep(self.server.latency * self.server.random.uniform(0.5, 1.5))
+        for route_method, pattern, handler in ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                self.server.count(f"{method} {pattern.pattern[:-1]}")
+                roll = 1.0 if handler in LOGIN_HANDLERS else self.server.random.random()
+                if roll < self.server.rate_limit_rate:
+                    self._send(429, {"message": "Too Many Requests"}, {"Retry-After": f"{self.server.retry_after:g}"})
+                elif roll < self.server.rate_limit_rate + self.server.error_rate:
+                    self._send(503, {"message": "Service Unavailable"})
+                else:
+                    with self.server.dataset.lock:
+                        getattr(self, handler)(*match.groups())
+                return
+        self._send(404, {"message": f"{method} {url.path} nicht implementiert"})
+
+    def _send(self, status: int, payload: dict | None = None, headers: dict[str, str] | None = None):
+        body = json.dumps(payload if payload is not None else {}).encode("utf-8")
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        if self.command == "GET" and status == 200 and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.command == "GET" and status in (200, 304):
+            self.send_header("ETag", etag)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json_body(self) -> dict:
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(self.body or b"{}")
+        return dict(urllib.parse.parse_qsl(self.body.decode("utf-8")))
+
+    def _ct_page(self, items: list):
+        limit = int(self.query.get("limit") or self.server.page_size)
+        page = int(self.query.get("page") or 1)
+        last_page = max(1, math.ceil(len(items) / limit))
+        data = items[(page - 1) * limit : page * limit]
+        pagination = {"total": len(items), "limit": limit, "current": page, "lastPage": last_page}
+        self._send(200, {"data": data, "meta": {"count": len(data), "pagination": pagination}})
+
+    def _wt_page(self, docs: list):
+        rows = int(self.query.get("rows") or self.server.page_size)
+        start = int(self.query.get("start") or 0)
+        self._send(200, {"response": {"numFound": len(docs), "start": start, "docs": docs[start : start + rows]}})
+
+    # ChurchTools
+
+    def ct_whoami(self):
+        if not self.headers.get("Authorization", "").startswith("Login "):
+            self._send(401, {"message": "Session expired"})
+            return
+        self._send(200, {"data": {"id": 1, "email": "mock@example.test"}})
+
+    def ct_login(self):
+        self._send(200, {"data": {"id": 1}}, {"Set-Cookie": "ChurchTools_ct_mock=session; Path=/"})
+
+    def ct_csrftoken(self):
+        self._send(200, {"data": "mock-csrf-token"})
+
+    def ct_songs(self):
+        self._ct_page(self.server.dataset.ct_songs)
+
+    def ct_create_song(self):
+        song = {**self._json_body(), "id": self.server.dataset.new_id(), "arrangements": []}
+        song.pop("categoryId", None)
+        song["category"] = {}
+        self.server.dataset.ct_songs.append(song)
+        self._send(201, {"data": song})
+
+    def ct_create_arrangement(self, song_id: str):
+        song = next((s for s in self.server.dataset.ct_songs if s["id"] == int(song_id)), None)
+        if not song:
+            self._send(404, {"message": "Song not found"})
+            return
+        arrangement = {"id": self.server.dataset.new_id(), **self._json_body()}
+        song["arrangements"].append(arrangement)
+        self._send(201, {"data": arrangement})
+
+    def ct_events(self):
+        start = self.query.get("from", "0000")
+        end = self.query.get("to", "9999")
+        events = [event for event in self.server.dataset.ct_events if start <= event["startDate"][:10] <= end]
+        self._ct_page(events)
+
+    def ct_agenda(self, event_id: str):
+        self._send(200, {"data": self.server.dataset.agenda(int(event_id))})
+
+    def ct_create_agenda_item(self, event_id: str):
+        items = self.server.dataset.agenda(int(event_id))["items"]
+        item = {**self._json_body(), "id": self.server.dataset.new_id()}
+        index = len(items)
+        if "before_id" in self.query:
+            index = next((i for i, current in enumerate(items) if str(current["id"]) == self.query["before_id"]), index)
+        elif "after_id" in self.query:
+            index = next((i + 1 for i, current in enumerate(items) if str(current["id"]) == self.query["after_id"]), index)
+        items.insert(index, item)
+        for position, current in enumerate(items):
+            current["position"] = position
+        self._send(201, {"data": item})
+
+    def ct_update_agenda_item(self, event_id: str, item_id: str):
+        items = self.server.dataset.agenda(int(event_id))["items"]
+        item = next((current for current in items if current["id"] == int(item_id)), None)
+        if not item:
+            self._send(404, {"message": "Agenda item not found"})
+            return
+        item.update(self._json_body())
+        self._send(200, {"data": item})
+
+    # Worshiptools
+
+    def wt_app(self):
+        self._send(200, {})
+
+    def wt_login(self):
+        token = hashlib.sha256(datetime.now(timezone.utc).isoformat().encode("utf-8")).hexdigest()
+        self._send(200, {}, {"Set-Cookie": f"weAuthToken={token}; Path=/"})
+
+    def wt_songs(self):
+        self._wt_page(self.server.dataset.wt_songs)
+
+    def wt_services(self):
+        start = self.query.get("startDate", "0000")
+        end = self.query.get("endDate", "9999")
+        self._wt_page([s for s in self.server.dataset.wt_services if any(start <= t[:10] <= end for t in s["times"])])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock-Server für ChurchTools und Worshiptools")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--songs", type=int, default=1000, help="Anzahl der Songs in beiden Katalogen")
+    parser.add_argument("--events", type=int, default=100, help="Anzahl der Services/Events (alle drei Stunden ab morgen)")
+    parser.add_argument("--agenda-items", type=int, default=20, help="Anzahl der Items je Agenda")
+    parser.add_argument("--latency", type=float, default=0, help="Sekunden Verzögerung je Anfrage (±50 %% Jitter)")
+    parser.add_argument("--error-rate", type=float, default=0, help="Anteil der Anfragen mit 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="Anteil der Anfragen mit 429")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After Sekunden bei 429")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = Mock_Server(
+        (args.host, args.port),
+        Mock_Dataset(args.songs, args.events, args.agenda_items, args.seed),
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    logging.info(f"Mock-Server läuft auf http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging.info(f"Anfragen: {json.dumps(server.requests, indent=2)}")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
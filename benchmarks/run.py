@@ -0,0 +1,200 @@
+"""
+Benchmarks für Song_Matcher, Event_Matcher, Cacher und CT_Event_Manager mit synthetischen Daten, komplett offline.
+
+    python -m benchmarks.run                                   # alle Größen als Tabelle ausgeben
+    python -m benchmarks.run --sizes 1000 10000 --record       # Ergebnisse als Baseline speichern
+    python -m benchmarks.run --compare benchmarks/baseline.json
+
+Zeit ist das Minimum aus --repeat Läufen ohne Tracing, der Speicher-Peak kommt aus einem eigenen Lauf mit tracemalloc.
+Die Baseline ist nur auf derselben Maschine mit derselben Python-Version aussagekräftig, --compare warnt bei einer
+anderen Python-Version.
+"""
+
+import argparse
+from datetime import datetime, timezone
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable
+
+from benchmarks import synthetic
+from cache import Cacher, SqliteDatabase, YamlDatabase
+from manager import CT_Event_Manager
+from matcher import Event_Matcher, Song_Matcher
+
+SIZES = (1_000, 10_000, 100_000)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Ein Benchmark liefert für eine Katalog-Größe (setup, run): setup erzeugt frischen Zustand, nur run wird gemessen
+Benchmark = Callable[[int, str], tuple[Callable[[], Any], Callable[[Any], Any]]]
+
+
+def events_for(size: int) -> int:
+    return max(10, size // 20)
+
+
+def song_matcher_build(size: int, tmp_dir: str):
+    wt_songs, ct_songs = synthetic.wt_songs(size), synthetic.ct_songs(size)
+    return lambda: (wt_songs, ct_songs), lambda songs: Song_Matcher(*songs)
+
+
+def song_matcher_match(size: int, tmp_dir: str):
+    song_matcher = Song_Matcher(synthetic.wt_songs(size), synthetic.ct_songs(size))
+    wt_song_ids = [wt_song["id"] for wt_song in song_matcher.wt_songs]
+    return lambda: wt_song_ids, lambda ids: [song_matcher.match(wt_song_id) for wt_song_id in ids]
+
+
+def event_matcher_match(size: int, tmp_dir: str):
+    wt_events, ct_events = synthetic.calendar(events_for(size), size)
+    event_matcher = Event_Matcher(synthetic.TZ, synthetic.TZ, synthetic.CONFIG)
+    return lambda: (wt_events, ct_events), lambda events: event_matcher.match(*events)
+
+
+def _cacher(database_class: type, suffix: str):
+    def benchmark(size: int, tmp_dir: str):
+        wt_events, ct_events = synthetic.calendar(events_for(size), size)
+        matches = Event_Matcher(synthetic.TZ, synthetic.TZ, synthetic.CONFIG).match(wt_events, ct_events)
+        file_names = (os.path.join(tmp_dir, f"cacher-{size}-{i}.{suffix}") for i in itertools.count())
+
+        def setup():
+            if database_class is YamlDatabase:
+                return YamlDatabase(next(file_names), write_behind=True)
+            return database_class(next(file_names))
+
+        def run(db):
+            # Zweiter Durchlauf wie im Daemon: alles ist bereits im Cache
+            for _ in range(2):
+                cacher = Cacher(db)
+                for match in matches:
+                    if not cacher.is_already_synced(match):
+                        cacher.cache_sync(match)
+                db.flush()
+
+        return setup, run
+
+    return benchmark
+
+
+def place_songs(size: int, tmp_dir: str):
+    ct_agenda = synthetic.agenda(max(10, size // 100))
+    songs = synthetic.ct_songs(size)[:6]
+    song_placements = synthetic.CONFIG["ct_events"][0]["song_placements"]
+
+    def setup():
+        api = synthetic.Fake_Agenda_API(ct_agenda)
+        return [CT_Event_Manager(api, synthetic.CONFIG, ct_event_id) for ct_event_id in range(20)]
+
+    def run(event_managers):
+        for event_manager in event_managers:
+            event_manager.place_songs(songs, song_placements)
+
+    return setup, run
+
+
+BENCHMARKS: dict[str, Benchmark] = {
+    "song_matcher_build": song_matcher_build,
+    "song_matcher_match": song_matcher_match,
+    "event_matcher_match": event_matcher_match,
+    "cacher_yaml": _cacher(YamlDatabase, "yaml"),
+    "cacher_sqlite": _cacher(SqliteDatabase, "sqlite"),
+    "place_songs": place_songs,
+}
+
+
+def measure(setup: Callable[[], Any], run: Callable[[Any], Any], repeat: int) -> dict[str, float]:
+    state = setup()
+    tracemalloc.start()
+    try:
+        run(state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    seconds = []
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        seconds.append(time.perf_counter() - start)
+    return {"seconds": round(min(seconds), 6), "peak_kib": round(peak / 1024, 1)}
+
+
+def run_benchmarks(names: list[str], sizes: list[int], repeat: int) -> dict[str, dict[str, float]]:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in names:
+            for size in sizes:
+                setup, run = BENCHMARKS[name](size, tmp_dir)
+                result = measure(setup, run, repeat)
+                results[f"{name}/{size}"] = result
+                print(f"{name:<22} {size:>7} {result['seconds'] * 1000:>11.2f} ms {result['peak_kib']:>12.1f} KiB")
+    return results
+
+
+def compare(results: dict[str, dict[str, float]], baseline: dict, max_regression: float) -> list[str]:
+    """Liefert die Benchmarks, deren Zeit mehr als max_regression mal so lang wie in der Baseline ist."""
+    baseline_python = baseline.get("python", "unbekannt")
+    if baseline_python.split(".")[:2] != platform.python_version().split(".")[:2]:
+        # Zwischen Python-Versionen unterscheiden sich Laufzeit und Speicher deutlich
+        print(
+            f"\nWarnung: Baseline wurde mit Python {baseline_python} aufgenommen, dieser Lauf nutzt "
+            f"Python {platform.python_version()}. Für einen Vergleich die Baseline mit dieser Version neu "
+            "aufnehmen (--record)."
+        )
+    regressions = []
+    print(f"\n{'Vergleich mit Baseline':<30} {'Zeit':>8} {'Speicher':>9}")
+    for key, result in results.items():
+        base = baseline["results"].get(key)
+        if not base:
+            continue
+        time_ratio = result["seconds"] / base["seconds"] if base["seconds"] else 1
+        memory_ratio = result["peak_kib"] / base["peak_kib"] if base["peak_kib"] else 1
+        marker = " <- langsamer" if time_ratio > max_regression else ""
+        print(f"{key:<30} {time_ratio:>7.2f}x {memory_ratio:>8.2f}x{marker}")
+        if time_ratio > max_regression:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks mit synthetischen Worshiptools/ChurchTools Daten")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="Anzahl der Songs im Katalog")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS), help="Nur diese Benchmarks")
+    parser.add_argument("--repeat", type=int, default=3, help="Anzahl der gemessenen Läufe je Benchmark (Minimum zählt)")
+    parser.add_argument("--record", nargs="?", const=DEFAULT_BASELINE, help="Speichert die Ergebnisse als Baseline")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, help="Vergleicht mit einer Baseline")
+    parser.add_argument(
+        "--max-regression", type=float, default=1.5, help="Faktor, ab dem --compare mit Exit-Code 1 abbricht"
+    )
+    args = parser.parse_args()
+
+    print(f"{'Benchmark':<22} {'Songs':>7} {'Zeit':>14} {'Speicher-Peak':>16}")
+    results = run_benchmarks(args.only, args.sizes, args.repeat)
+
+    if args.record:
+        baseline = {
+            "recorded": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "results": results,
+        }
+        with open(args.record, "w", encoding="utf-8") as file:
+            json.dump(baseline, file, indent=2)
+            file.write("\n")
+        print(f"\nBaseline gespeichert in {args.record}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.max_regression)
+        if regressions:
+            print(f"\nLangsamer als {args.max_regression}x der Baseline: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Synthetische Worshiptools/ChurchTools Daten und Fake-Clients für die Benchmarks (deterministisch per seed)."""
+
+import copy
+from datetime import datetime, timedelta, timezone
+import random
+from zoneinfo import ZoneInfo
+
+from custom_types import CT_Event, CT_Song, Config, WT_Event, WT_Song
+
+TZ = "Europe/Berlin"
+
+CONFIG: Config = {
+    "ct_events": [
+        {
+            "name": "Gottesdienst",
+            "regex": "(?<!Heilig Abend )Gottesdienst",
+            "campus_name": None,
+            "song_placements": [
+                {"agenda_item": {"title": "Lobpreis", "type": "header"}, "position": "after", "songs": "[:-1]"},
+                {"agenda_item": {"title": "Abschluss", "type": "header"}, "position": "after", "songs": "[-1]"},
+            ],
+        },
+        {
+            "name": "Fokus",
+            "regex": None,
+            "campus_name": None,
+            "song_placements": [{"agenda_item": {"type": "song"}, "position": "at", "songs": "[:]"}],
+        },
+    ],
+    "ct_item_defaults": {"responsible": "[Lobpreisleitung]", "duration": 300},
+    "ct_song_defaults": {"songcategory_id": 4},
+}
+
+EVENT_NAMES = ["Gottesdienst", "Fokus Abend", "Heilig Abend Gottesdienst", "Jugend", "Gebet"]
+
+
+def wt_songs(count: int) -> list[WT_Song]:
+    """Jeder vierte Song hat keine CCLI-Nummer und wird über Name und Autor abgeglichen."""
+    return [
+        {
+            "id": f"wt{i:06d}",
+            "name": f"Song {i}",
+            "artist": f"Artist {i % 997}",
+            "ccli": str(1_000_000 + i) if i % 4 else None,
+            "key": "G",
+        }
+        for i in range(count)
+    ]
+
+
+def ct_songs(count: int, coverage: float = 0.9, seed: int = 0) -> list[CT_Song]:
+    """ChurchTools Katalog, der `coverage` der Worshiptools Songs (gemischte Reihenfolge) enthält."""
+    rng = random.Random(seed)
+    indices = rng.sample(range(count), int(count * coverage))
+    return [
+        {
+            "id": i + 1,
+            "name": f"Song {i}",
+            "author": f"Artist {i % 997}",
+            "ccli": str(1_000_000 + i) if i % 4 else None,
+            "arrangements": [{"id": 10_000_000 + i}],
+            "category": {},
+        }
+        for i in indices
+    ]
+
+
+def calendar(count: int, song_count: int, seed: int = 0) -> tuple[list[WT_Event], list[CT_Event]]:
+    """
+    count Worshiptools Services und ChurchTools Events ab morgen, alle drei Stunden eins.
+    Jeder zweite WT Service hat keine passende CT Zeit, die Namen decken passende und unpassende Konfigurationen ab.
+    """
+    rng = random.Random(seed)
+    tzinfo = ZoneInfo(TZ)
+    start = datetime.now(tzinfo).replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    wt_events: list[WT_Event] = []
+    ct_events: list[CT_Event] = []
+    for i in range(count):
+        local_start = start + timedelta(hours=3 * i)
+        wt_start = local_start if i % 2 == 0 else local_start + timedelta(minutes=30)
+        wt_events.append(
+            {
+                "id": f"service{i}",
+                "times": [wt_start.strftime("%Y-%m-%dT%H:%M")],
+                "songs": [f"wt{rng.randrange(song_count):06d}" for _ in range(6)],
+                "name": None,
+                "type": "service",
+                "mod": "",
+            }
+        )
+        ct_events.append(
+            {
+                "id": i + 1,
+                "name": EVENT_NAMES[i % len(EVENT_NAMES)],
+                "startDate": local_start.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "calendar": {"domainAttributes": {"campusName": "Campus"}},
+            }
+        )
+    return wt_events, ct_events
+
+
+def agenda(item_count: int) -> dict:
+    """Agenda mit Lobpreis nach dem ersten Drittel, zwei bestehenden Song-Items und Abschluss am Ende."""
+    item_count = max(item_count, 6)
+    lobpreis = item_count // 3
+    items = []
+    for position in range(item_count):
+        item = {"id": position + 1, "position": position, "sortkey": position, "title": "Text", "type": "normal"}
+        if position == lobpreis:
+            item.update(title="Lobpreis", type="header")
+        elif position in (lobpreis + 1, lobpreis + 2):
+            item.update(title="", type="song", song={"songId": -position})
+        elif position == item_count - 2:
+            item.update(title="Abschluss", type="header")
+        items.append(item)
+    return {"id": 1, "items": items}
+
+
+class Fake_Agenda_API:
+    def __init__(self, ct_agenda: dict):
+        """Wie FakeAgendaApi in tests/test_manager.py, aber für beliebige Events und ohne Assertions."""
+        self.ct_agenda = ct_agenda
+        self.next_item_id = 1_000_000
+        self.calls = 0
+
+    def get(self, endpoint: str):
+        self.calls += 1
+        return {"data": copy.deepcopy(self.ct_agenda)}
+
+    def create_agenda_item(self, event_id: int, item: dict, before_id: int | None = None, after_id: int | None = None):
+        self.calls += 1
+        self.next_item_id += 1
+        return {"data": {"id": self.next_item_id, **item}}
+
+    def update_agenda_item(
+        self, event_id: int, item_id: int, item: dict, before_id: int | None = None, after_id: int | None = None
+    ):
+        self.calls += 1
+        return {"data": {"id": item_id, **item}}
@@ -1,29 +1,152 @@
-from datetime import datetime, timezone
+from abc import ABC, abstractmethod
+import atexit
+from datetime import datetime, timedelta, timezone
 import hashlib
 import json
+import logging
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
 import yaml
-from typing import Any, Dict
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, TypedDict
+from urllib.request import pathname2url
 
-from custom_types import Config_CT_Event
-from matcher import Event_Config_Match
+from custom_types import CT_Song, WT_Song
+from matcher import Event_Config_Match, Song_Matcher
 
+if TYPE_CHECKING:
+    from churchtools_api import Churchtools_API
+    from worshiptools_api import Worshiptools_API
 
-class YamlDatabase:
-    def __init__(self, file_path: str):
+
+# Umask des Prozesses, neue Dateien bekommen dieselben Rechte wie mit open() (os.umask lässt sich nur setzen)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+class Cache_Entry(TypedDict):
+    event_datetime: str
+    last_sync: str
+    hash: str
+
+
+class Database(ABC):
+    """Schnittstelle für den Sync-State Speicher hinter dem Cacher."""
+
+    cache_key = "cache"
+
+    @abstractmethod
+    def insert(self, key: str, value: Any) -> None: ...
+
+    @abstractmethod
+    def get(self, key: str) -> Any: ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    def get_cache_entries(self) -> list[Cache_Entry]: ...
+
+    @abstractmethod
+    def add_cache_entry(self, entry: Cache_Entry) -> None: ...
+
+    @abstractmethod
+    def delete_cache_entries_before(self, event_datetime: datetime) -> None: ...
+
+    def flush(self) -> None:
+        """Schreibt gepufferte Änderungen (falls vorhanden)."""
+
+    def restrict_access(self) -> None:
+        """Macht die Datei nur noch für den Besitzer lesbar (z.B. sobald unverschlüsselte Tokens darin liegen)."""
+
+
+def _owner_only(file_path: str) -> None:
+    try:
+        mode = stat.S_IMODE(os.stat(file_path).st_mode)
+        if mode & 0o077:
+            os.chmod(file_path, mode & ~0o077)
+    except FileNotFoundError:
+        pass
+    except PermissionError:
+        logging.warning(f"Zugriffsrechte von {file_path} können nicht eingeschränkt werden, SYNC_STATE_KEY setzen")
+
+
+class YamlDatabase(Database):
+    def __init__(self, file_path: str, write_behind: bool = False, read_only: bool = False):
+        """
+        :param file_path: Pfad zur YAML-Datei.
+        :param write_behind: Lädt die Datei nur einmal, hält alle Änderungen im Speicher und schreibt sie erst bei
+            flush() (spätestens beim Beenden des Prozesses) zurück.
+        :param read_only: Wie write_behind, aber die Änderungen werden nie in die Datei geschrieben (z.B. für --plan).
+        """
         self.file_path = file_path
+        self.write_behind = write_behind or read_only
+        self.read_only = read_only
+        self.owner_only = False
+        self._data: Dict[str, Any] | None = None
+        self._dirty = False
+        if write_behind and not read_only:
+            atexit.register(self.flush)
 
     def _load_data(self) -> Dict[str, Any]:
-        """Lädt Daten aus der YAML-Datei."""
+        """Lädt Daten aus der YAML-Datei bzw. aus dem Speicher."""
+        if not self.write_behind:
+            return self._read_file()
+        if self._data is None:
+            self._data = self._read_file()
+        return self._data
+
+    def _save_data(self, data: Dict[str, Any]) -> None:
+        """Speichert Daten in der YAML-Datei bzw. markiert sie im Speicher als geändert."""
+        if not self.write_behind:
+            self._write_file(data)
+            return
+        self._data = data
+        self._dirty = True
+
+    def flush(self) -> None:
+        """Schreibt ungespeicherte Änderungen in die YAML-Datei."""
+        if self._dirty and self._data is not None and not self.read_only:
+            self._write_file(self._data)
+            self._dirty = False
+
+    def _read_file(self) -> Dict[str, Any]:
         try:
             with open(self.file_path, "r") as file:
                 return yaml.safe_load(file) or {}  # Lädt Daten oder gibt ein leeres Dict zurück
         except FileNotFoundError:
             return {}  # Datei existiert noch nicht, gib leeres Dict zurück
 
-    def _save_data(self, data: Dict[str, Any]) -> None:
-        """Speichert Daten in der YAML-Datei."""
-        with open(self.file_path, "w") as file:
-            yaml.safe_dump(data, file)
+    def _write_file(self, data: Dict[str, Any]) -> None:
+        """Schreibt atomar über eine temporäre Datei und rename, die Zugriffsrechte der bestehenden Datei bleiben."""
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".db-", suffix=".yaml.tmp")
+        try:
+            # mkstemp legt die Datei mit 0600 an, ohne chmod wäre die DB nach dem rename nur noch für den Besitzer lesbar
+            try:
+                mode = stat.S_IMODE(os.stat(self.file_path).st_mode)
+            except FileNotFoundError:
+                mode = 0o666 & ~_UMASK
+            os.chmod(tmp_path, mode & ~0o077 if self.owner_only else mode)
+            with os.fdopen(fd, "w") as file:
+                yaml.safe_dump(data, file)
+            try:
+                os.replace(tmp_path, self.file_path)
+            except OSError:
+                # Z.B. bei einer als einzelne Datei gemounteten db.yaml (Docker) ist kein rename möglich
+                with open(self.file_path, "w") as file:
+                    yaml.safe_dump(data, file)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def restrict_access(self) -> None:
+        if self.read_only:
+            return
+        self.owner_only = True
+        _owner_only(self.file_path)
 
     def insert(self, key: str, value: Any) -> None:
         """Fügt ein neues Element hinzu oder aktualisiert ein bestehendes."""
@@ -36,6 +159,10 @@ class YamlDatabase:
         data = self._load_data()
         return data.get(key, None)
 
+    def items(self) -> list[tuple[str, Any]]:
+        """Alle Schlüssel mit ihren Werten (inklusive des Caches)."""
+        return list(self._load_data().items())
+
     def delete(self, key: str) -> None:
         """Löscht ein Element anhand des Schlüssels."""
         data = self._load_data()
@@ -43,45 +170,167 @@ class YamlDatabase:
             del data[key]
             self._save_data(data)
 
+    def get_cache_entries(self) -> list[Cache_Entry]:
+        return self.get(self.cache_key) or []
 
-class Cache_Entry:
-    event_datetime: str
-    last_sync: str
-    hash: str
+    def add_cache_entry(self, entry: Cache_Entry) -> None:
+        entries = self.get_cache_entries()
+        entries.append(entry)
+        self.insert(self.cache_key, entries)
 
+    def delete_cache_entries_before(self, event_datetime: datetime) -> None:
+        entries = [
+            entry for entry in self.get_cache_entries() if datetime.fromisoformat(entry["event_datetime"]) >= event_datetime
+        ]
+        self.insert(self.cache_key, entries)
 
-class Cacher:
-    cache_key = "cache"
 
-    def __init__(self, db: YamlDatabase):
+# Die ersten 16 Bytes jeder SQLite Datenbankdatei
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+
+class SqliteDatabase(Database):
+    def __init__(self, file_path: str, read_only: bool = False):
+        """
+        Sync-State in einer SQLite Datenbank (WAL-Modus, jede Änderung wird sofort committet).
+
+        :param read_only: Kopiert die Datenbank beim Öffnen in den Speicher, Änderungen landen nur in der Kopie
+            (z.B. für --plan).
+        """
+        self.file_path = file_path
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._check_file()
+        if read_only:
+            self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+            if os.path.exists(file_path):
+                source = sqlite3.connect(f"file:{pathname2url(os.path.abspath(file_path))}?mode=ro", uri=True)
+                source.backup(self.connection)
+                source.close()
+        else:
+            self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        with self._lock, self.connection:
+            if not read_only:
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (hash TEXT PRIMARY KEY, event_datetime TEXT NOT NULL, last_sync TEXT NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS cache_event_datetime ON cache (event_datetime)")
+
+    def _check_file(self) -> None:
+        """Verhindert, dass eine YAML DB (z.B. das Standard db.yaml) als SQLite geöffnet und dabei überschrieben wird."""
+        if os.path.splitext(self.file_path)[1].lower() in (".yaml", ".yml"):
+            raise ValueError(f"{self.file_path} ist eine YAML Datei, für SQLite eine andere Datei angeben (z.B. db.sqlite)")
+        try:
+            with open(self.file_path, "rb") as file:
+                header = file.read(len(SQLITE_HEADER))
+        except FileNotFoundError:
+            return
+        if header and header != SQLITE_HEADER:
+            raise ValueError(f"{self.file_path} ist keine SQLite Datenbank (für YAML --db-backend yaml verwenden)")
+
+    def insert(self, key: str, value: Any) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            row = self.connection.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, key: str) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def get_cache_entries(self) -> list[Cache_Entry]:
+        with self._lock:
+            rows = self.connection.execute("SELECT event_datetime, last_sync, hash FROM cache").fetchall()
+        return [{"event_datetime": row[0], "last_sync": row[1], "hash": row[2]} for row in rows]
+
+    def add_cache_entry(self, entry: Cache_Entry) -> None:
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache (hash, event_datetime, last_sync) VALUES (?, ?, ?)",
+                (entry["hash"], self._to_utc_iso(entry["event_datetime"]), self._to_utc_iso(entry["last_sync"])),
+            )
+
+    def delete_cache_entries_before(self, event_datetime: datetime) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM cache WHERE event_datetime < ?", (self._to_utc_iso(event_datetime),))
+
+    def restrict_access(self) -> None:
+        # WAL- und SHM-Datei enthalten ebenfalls Daten, neue übernehmen die Rechte der Datenbankdatei
+        if not self.read_only:
+            for suffix in ("", "-wal", "-shm"):
+                _owner_only(self.file_path + suffix)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _to_utc_iso(self, value: str | datetime) -> str:
+        """Einheitliches UTC-Format, damit event_datetime per Textvergleich sortierbar ist."""
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if value.tzinfo is None:
+            value = value.astimezone()
+        return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+# Vermerk in der SQLite DB, dass eine YAML DB bereits übernommen wurde
+migration_key = "yaml_migration"
+
+
+def migrate_yaml_to_sqlite(yaml_db: YamlDatabase, sqlite_db: SqliteDatabase) -> None:
+    """Übernimmt einmalig alle Daten einer bestehenden YAML DB in die SQLite DB.
+    Die Übernahme wird in der SQLite DB vermerkt, weitere Aufrufe (z.B. bei jedem Cron-Lauf) tun nichts."""
+    migration = sqlite_db.get(migration_key)
+    if migration:
+        logging.debug(f"{migration['source']} wurde bereits am {migration['migrated_at']} übernommen")
+        return
+    for key, value in yaml_db.items():
+        if key != Database.cache_key:
+            sqlite_db.insert(key, value)
+    cache_entries = yaml_db.get_cache_entries()
+    for entry in cache_entries:
+        sqlite_db.add_cache_entry(entry)
+    sqlite_db.insert(
+        migration_key,
+        {"source": os.path.abspath(yaml_db.file_path), "migrated_at": datetime.now(timezone.utc).isoformat()},
+    )
+    logging.info(f"{len(cache_entries)} Cache-Einträge aus {yaml_db.file_path} übernommen")
+
+
+class Cacher:
+    def __init__(self, db: Database):
         self.db = db
-        if not self.db.get(self.cache_key):
-            self.db.insert(self.cache_key, [])
-        self._clean_cache()
+        self._lock = threading.Lock()
+        self.db.delete_cache_entries_before(datetime.now(timezone.utc))
+        # Hash -> Zeitpunkt des Events, damit clean_cache auch vergangene Hashes im Speicher verwerfen kann
+        self.hashes: dict[str, datetime] = {
+            entry["hash"]: self._event_datetime(entry) for entry in self.db.get_cache_entries()
+        }
 
     def is_already_synced(self, event_config_match: Event_Config_Match):
-        entries: list[Cache_Entry] = self.db.get(self.cache_key)
-        current_hash = self._create_hash(event_config_match)
-
-        # Prüfe ob es einen Eintrag mit gleichem Hash gibt
-        for entry in entries:
-            if entry["hash"] == current_hash:
-                return True
-        return False
+        return self._create_hash(event_config_match) in self.hashes
 
     def cache_sync(self, event_config_match: Event_Config_Match):
-        entries: list[Cache_Entry] = self.db.get(self.cache_key)
-        entries.append(self._event_config_match_to_cache(event_config_match))
-        self.db.insert(self.cache_key, entries)
+        entry = self._event_config_match_to_cache(event_config_match)
+        with self._lock:
+            self.db.add_cache_entry(entry)
+            self.hashes[entry["hash"]] = self._event_datetime(entry)
 
-    def _clean_cache(self):
-        entries: list[Cache_Entry] = self.db.get(self.cache_key)
+    def clean_cache(self):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            self.db.delete_cache_entries_before(now)
+            self.hashes = {
+                entry_hash: event_datetime for entry_hash, event_datetime in self.hashes.items() if event_datetime >= now
+            }
 
-        valid_entries = [
-            entry for entry in entries if datetime.fromisoformat(entry["event_datetime"]) >= datetime.now(timezone.utc)
-        ]
-
-        self.db.insert(self.cache_key, valid_entries)
+    def _event_datetime(self, entry: Cache_Entry) -> datetime:
+        event_datetime = datetime.fromisoformat(entry["event_datetime"])
+        return event_datetime if event_datetime.tzinfo else event_datetime.astimezone()
 
     def _event_config_match_to_cache(self, event_config_match: Event_Config_Match):
         cache_entry: Cache_Entry = {
@@ -99,3 +348,80 @@ class Cacher:
         hash_input = {"wt_event_id": wt_event_id, "ct_event_id": ct_event_id, "wt_songs": wt_songs, "config": config}
         json_data = json.dumps(hash_input, sort_keys=True).encode("utf-8")
         return hashlib.sha256(json_data).hexdigest()
+
+
+class Song_Library_Cacher:
+    song_library_key = "song_library"
+    wt_song_keys = ("id", "name", "artist", "ccli")
+    ct_song_keys = ("id", "name", "author", "ccli")
+
+    def __init__(self, db: Database, ttl: timedelta):
+        """
+        Hält die Song-Kataloge beider Systeme im Sync-State vor.
+        Innerhalb der TTL wird nur die Anzahl der Songs abgefragt, bei Abweichung oder abgelaufener TTL alles neu geladen.
+        Änderungen, die die Anzahl nicht verändern (ein Song gelöscht und einer angelegt, Name oder CCLI bearbeitet),
+        erkennt die Probe nicht, sie werden erst nach Ablauf der TTL übernommen. Unbekannte Worshiptools IDs lösen
+        unabhängig davon ein Neuladen aus (refresh).
+        """
+        self.db = db
+        self.ttl = ttl
+        self.library: dict[str, Any] = self.db.get(self.song_library_key) or {}
+        self.fetched_at: dict[str, str] = {}
+
+    def wt_songs(self, wt_api: "Worshiptools_API", refresh: bool = False) -> Iterable[WT_Song]:
+        def probe_count():
+            res = wt_api.get("song", {"rows": 1})
+            return res.get("numFound") if res else None
+
+        return self._songs(
+            "wt", probe_count, lambda: wt_api.iter_all("song", {"rows": 100}, prefetch=wt_api.max_workers), refresh
+        )
+
+    def ct_songs(self, ct_api: "Churchtools_API") -> Iterable[CT_Song]:
+        def probe_count():
+            res = ct_api.get("songs", {"limit": 1})
+            return res.get("meta", {}).get("pagination", {}).get("total") if res else None
+
+        return self._songs(
+            "ct", probe_count, lambda: ct_api.iter_all("songs", {"limit": 100}, prefetch=ct_api.max_workers)
+        )
+
+    def save(self, song_matcher: Song_Matcher):
+        """Speichert die (ggf. um neu angelegte Songs ergänzten) Kataloge des Song_Matchers, falls sie sich geändert haben."""
+        library = dict(self.library)
+        if "wt" in self.fetched_at:
+            wt_songs = [self._trim_wt_song(wt_song) for wt_song in song_matcher.wt_songs]
+            library["wt"] = {"fetched_at": self.fetched_at["wt"], "songs": wt_songs}
+        if "ct" in self.fetched_at:
+            ct_songs = [self._trim_ct_song(ct_song) for ct_song in song_matcher.ct_songs]
+            library["ct"] = {"fetched_at": self.fetched_at["ct"], "songs": ct_songs}
+        if library != self.library:
+            self.library = library
+            self.db.insert(self.song_library_key, self.library)
+
+    def _songs(
+        self,
+        system: str,
+        probe_count: Callable[[], int | None],
+        fetch_all: Callable[[], Iterable[dict]],
+        refresh: bool = False,
+    ):
+        now = datetime.now(timezone.utc)
+        cached = self.library.get(system)
+        if cached and not refresh and now - datetime.fromisoformat(cached["fetched_at"]) < self.ttl:
+            count = probe_count()
+            if count == len(cached["songs"]):
+                logging.info(f"Song-Katalog {system} aus dem Cache geladen ({count} Songs)")
+                self.fetched_at[system] = cached["fetched_at"]
+                return cached["songs"]
+            logging.info(f"Song-Katalog {system} hat sich geändert ({len(cached['songs'])} -> {count}), lade neu")
+        self.fetched_at[system] = now.isoformat()
+        return fetch_all()
+
+    def _trim_wt_song(self, wt_song: WT_Song) -> WT_Song:
+        return {key: wt_song.get(key) for key in self.wt_song_keys}
+
+    def _trim_ct_song(self, ct_song: CT_Song) -> CT_Song:
+        song = {key: ct_song.get(key) for key in self.ct_song_keys}
+        song["arrangements"] = [{"id": arrangement["id"]} for arrangement in ct_song.get("arrangements", [])]
+        return song
@@ -1,13 +1,19 @@
+from collections import Counter
 from datetime import datetime, date
 from decimal import Decimal
+import itertools
 import json
 import logging
+import threading
 from typing import Optional
 import requests
 import urllib.parse
+from http_client import Http_Response_Cache, Retry_Policy, create_session, default_rate_limiter
 from telegram import send_telegram_message
+from token_store import Token_Store
+from utils import iter_prefetched
 
-from custom_types import CT_Song
+from custom_types import CT_Event, CT_Song
 
 REQUEST_TIMEOUT = 30
 
@@ -17,12 +23,25 @@ class ChurchtoolsApiError(Exception):
 
 
 class Churchtools_API:
+    max_workers = 4
+    notify = True
+    token_store: Optional[Token_Store] = None
+    response_cache: Optional[Http_Response_Cache] = None
+    retry_policy = Retry_Policy()
+    rate_limiter = default_rate_limiter
+    _login_kwargs: dict = {}
+    _login_lock = threading.Lock()
+    _csrf_refreshed_session: Optional[requests.Session] = None
+
     def __init__(
         self,
         base_url: str,
         ct_token: Optional[str] = None,
         ct_user: Optional[str] = None,
         ct_password: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        token_store: Optional[Token_Store] = None,
+        response_cache: Optional[Http_Response_Cache] = None,
     ):
         """Setup of a ChurchToolsApi object for the specified ct_domain using a token login.
 
@@ -31,6 +50,9 @@ class Churchtools_API:
             ct_token: direct access using a user token
             ct_user: indirect login using user and password combination
             ct_password: indirect login using user and password combination
+            max_workers: number of parallel requests used for pagination
+            token_store: persists the CSRF token between runs
+            response_cache: conditional GET cache (ETag/Last-Modified) for read requests
 
         """
         if not base_url:
@@ -40,13 +62,16 @@ class Churchtools_API:
 
         self.session = None
         self.base_url = base_url
+        self.token_store = token_store
+        self.response_cache = response_cache
+        if max_workers is not None:
+            self.max_workers = max_workers
 
         if ct_token is not None:
-            login_result = self.login_ct_rest_api(ct_token=ct_token)
+            self._login_kwargs = {"ct_token": ct_token}
         elif ct_user is not None and ct_password is not None:
-            login_result = self.login_ct_rest_api(ct_user=ct_user, ct_password=ct_password)
-        else:
-            login_result = False
+            self._login_kwargs = {"ct_user": ct_user, "ct_password": ct_password}
+        login_result = self.login_ct_rest_api(**self._login_kwargs) if self._login_kwargs else False
 
         if not login_result:
             raise ChurchtoolsApiError("ChurchTools login failed")
@@ -67,7 +92,7 @@ class Churchtools_API:
         :return: personId if login successful otherwise False
         :rtype: int | bool
         """
-        self.session = requests.Session()
+        self.session = create_session(pool_size=self.max_workers)
 
         if "ct_token" in kwargs:
             logging.info("Trying Login with token")
@@ -81,7 +106,7 @@ class Churchtools_API:
                     "Token Login Successful as %s",
                     response_content["data"]["email"],
                 )
-                self.session.headers["CSRF-Token"] = self.get_ct_csrf_token()
+                self.session.headers["CSRF-Token"] = self._csrf_token()
                 return json.loads(response.content)["data"]["id"]
             logging.warning(
                 "Token Login failed with %s",
@@ -97,7 +122,7 @@ class Churchtools_API:
 
             if response.status_code == 200:
                 logging.info("User/Password Login Successful")
-                self.session.headers["CSRF-Token"] = self.get_ct_csrf_token()
+                self.session.headers["CSRF-Token"] = self._csrf_token()
                 return json.loads(response.content)["data"]["id"]
             logging.warning(
                 "User/Password Login failed with %s",
@@ -126,6 +151,22 @@ class Churchtools_API:
         )
         return None
 
+    def _csrf_token(self, reuse: bool = True):
+        """CSRF Token aus dem token_store, sonst von ChurchTools abrufen und speichern.
+        Ein gespeicherter Token stammt aus einer früheren Session, lehnt ChurchTools ihn ab (403),
+        ruft _refresh_csrf_token einen neuen ab."""
+        csrf_token = self.token_store.get(self._csrf_token_name()) if self.token_store and reuse else None
+        if csrf_token:
+            logging.debug("CSRF Token aus dem token_store verwendet")
+            return csrf_token
+        csrf_token = self.get_ct_csrf_token()
+        if csrf_token and self.token_store:
+            self.token_store.save(self._csrf_token_name(), csrf_token)
+        return csrf_token
+
+    def _csrf_token_name(self):
+        return f"churchtools_csrf:{self.base_url}"
+
     def create_song(self, name: str, categoryId: int, author=None, copyright=None, ccli=None):
         """Method to create a new song and add arrangement"""
 
@@ -138,7 +179,8 @@ class Churchtools_API:
 
         new_song: CT_Song = response["data"]
         logging.debug("Song created successful with ID=%s", new_song["id"])
-        send_telegram_message(f"""*Neuer Song*
+        if self.notify:
+            send_telegram_message(f"""*Neuer Song*
 {new_song['name']}, {new_song['author']}
 https://songselect.ccli.com/songs/{new_song['ccli']}""")
 
@@ -157,28 +199,50 @@ https://songselect.ccli.com/songs/{new_song['ccli']}""")
             params_str = "?" + urllib.parse.urlencode(params)
         api_url = f"{self.base_url}/api/{endpoint}{params_str}"
         logging.info(f"GET {api_url}")
-        response = self.session.get(api_url, timeout=REQUEST_TIMEOUT)
+        if self.response_cache:
+            response = self.response_cache.fetch(api_url, lambda headers: self._request("get", api_url, headers=headers))
+        else:
+            response = self._request("get", api_url)
         if response.status_code == 200:
             return response.json()
         logging.error(f"Fehler bei der API-Anfrage: {response.status_code}, {response.text}")
         return None
 
     def get_all(self, endpoint: str, params: dict | None = None):
+        """Lädt alle Seiten eines paginierten Endpunkts, die Seiten nach der ersten parallel (max_workers)."""
+        return {"data": list(self.iter_all(endpoint, params, prefetch=self.max_workers))}
+
+    def get_events(self, start: date, end: date) -> list[CT_Event]:
+        """Alle Events von start bis end (jeweils inklusive) über alle Seiten.
+        Liefert ChurchTools keine Paginierung mit, ist die erste Antwort bereits vollständig."""
+        params = {"from": start.isoformat(), "to": end.isoformat()}
+        first_page = self.get("events", {**params, "page": 1})
+        if not first_page or "data" not in first_page:
+            raise ChurchtoolsApiError("ChurchTools API request failed for events")
+        if "pagination" not in first_page.get("meta", {}):
+            return first_page["data"]
+        return list(self.iter_all("events", params, prefetch=self.max_workers, first_page=first_page))
+
+    def iter_all(self, endpoint: str, params: dict | None = None, prefetch: int = 1, first_page: dict | None = None):
+        """Liefert die Einträge eines paginierten Endpunkts Seite für Seite.
+        Nach der ersten Seite ist lastPage bekannt, bis zu `prefetch` weitere Seiten werden im Hintergrund geladen.
+        Eine bereits geladene erste Seite kann als first_page übergeben werden.
+        """
         params = dict(params or {})
-        current_page = 0
-        last_page = 1
-        data = []
-        while current_page < last_page:
-            current_page = current_page + 1
-            params.update({"page": current_page})
-            res = self.get(endpoint, params)
-            if not res:
-                raise ChurchtoolsApiError(f"ChurchTools API request failed for {endpoint} page {current_page}")
-            if "meta" not in res or "pagination" not in res["meta"] or "data" not in res:
-                raise ChurchtoolsApiError(f"ChurchTools API response missing pagination metadata for {endpoint}")
-            last_page = res["meta"]["pagination"]["lastPage"]
-            data = data + res["data"]
-        return {"data": data}
+        first_page = first_page or self._get_page(endpoint, params, 1)
+        last_page = first_page["meta"]["pagination"]["lastPage"]
+        pages = iter_prefetched(lambda page: self._get_page(endpoint, params, page), range(2, last_page + 1), prefetch)
+        yield from first_page.pop("data")
+        for res in pages:
+            yield from res["data"]
+
+    def _get_page(self, endpoint: str, params: dict, page: int):
+        res = self.get(endpoint, {**params, "page": page})
+        if not res:
+            raise ChurchtoolsApiError(f"ChurchTools API request failed for {endpoint} page {page}")
+        if "meta" not in res or "pagination" not in res["meta"] or "data" not in res:
+            raise ChurchtoolsApiError(f"ChurchTools API response missing pagination metadata for {endpoint}")
+        return res
 
     def get_event_masterdata(self, **kwargs) -> list | list[list] | dict | list[dict]:
         """Function to get the Masterdata of the event module.
@@ -224,12 +288,8 @@ https://songselect.ccli.com/songs/{new_song['ccli']}""")
         api_url = f"{self.base_url}/api/{endpoint}{params_str}"
         json_data = json.dumps(data, cls=CustomEncoder)
         logging.info(f"POST {api_url}\n{json_data}")
-        response = self.session.post(
-            api_url,
-            data=json_data,
-            headers={"Content-Type": "application/json"},
-            timeout=REQUEST_TIMEOUT,
-        )
+        response = self._request("post", api_url, data=json_data, headers={"Content-Type": "application/json"})
+        self._invalidate_cached(endpoint)
         if response.status_code == 200 or response.status_code == 201:
             return response.json()
         logging.error(f"Fehler bei der API-Anfrage: {response.status_code}, {response.text}")
@@ -242,17 +302,67 @@ https://songselect.ccli.com/songs/{new_song['ccli']}""")
         api_url = f"{self.base_url}/api/{endpoint}{params_str}"
         json_data = json.dumps(data, cls=CustomEncoder)
         logging.info(f"PUT {api_url}\n{json_data}")
-        response = self.session.put(
-            api_url,
-            data=json_data,
-            headers={"Content-Type": "application/json"},
-            timeout=REQUEST_TIMEOUT,
-        )
+        response = self._request("put", api_url, data=json_data, headers={"Content-Type": "application/json"})
+        self._invalidate_cached(endpoint)
         if response.status_code in (200, 201):
             return response.json()
         logging.error(f"Fehler bei der API-Anfrage: {response.status_code}, {response.text}")
         return None
 
+    def _invalidate_cached(self, endpoint: str):
+        """Nach Schreibzugriffen sind gespeicherte GETs des Endpunkts und seiner übergeordneten Pfade veraltet,
+        z.B. events/1/agenda nach einem POST auf events/1/agenda/items."""
+        if not self.response_cache:
+            return
+        parts = endpoint.split("/")
+        for i in range(1, len(parts) + 1):
+            self.response_cache.invalidate(f"{self.base_url}/api/{'/'.join(parts[:i])}")
+
+    def _request(self, method: str, url: str, **kwargs):
+        """Sendet die Anfrage über die aktuelle Session (mit Retry und Rate Limit) und meldet sich bei 401 neu an."""
+        session = self.session
+        csrf_token = session.headers.get("CSRF-Token")
+        response = self._send(session, method, url, **kwargs)
+        if response.status_code == 401 and self._login_kwargs:
+            self._relogin(session)
+            response = self._send(self.session, method, url, **kwargs)
+        elif response.status_code == 403 and method != "get" and self._refresh_csrf_token(session, csrf_token):
+            response = self._send(self.session, method, url, **kwargs)
+        return response
+
+    def _refresh_csrf_token(self, session, rejected_token: str | None) -> bool:
+        """Ruft nach einem 403 einmalig einen neuen CSRF Token ab. True, wenn die Anfrage wiederholt werden soll."""
+        with self._login_lock:
+            if self.session is not session or self.session.headers.get("CSRF-Token") != rejected_token:
+                # Ein anderer Thread hat bereits neu angemeldet oder den Token erneuert
+                return True
+            # Höchstens einmal je Session, ein 403 kann auch eine fehlende Berechtigung sein
+            if rejected_token is None or self._csrf_refreshed_session is session:
+                return False
+            logging.info("CSRF Token abgelehnt, rufe einen neuen ab")
+            self._csrf_refreshed_session = session
+            csrf_token = self._csrf_token(reuse=False)
+            if not csrf_token:
+                return False
+            self.session.headers["CSRF-Token"] = csrf_token
+            return True
+
+    def _send(self, session: requests.Session, method: str, url: str, **kwargs):
+        def send():
+            return getattr(session, method)(url, timeout=REQUEST_TIMEOUT, **kwargs)
+
+        return self.retry_policy.send(method, url, send, self.rate_limiter)
+
+    def _relogin(self, expired_session):
+        with self._login_lock:
+            # Parallele Anfragen mit derselben abgelaufenen Session lösen nur einen Login aus
+            if self.session is expired_session:
+                logging.info("ChurchTools Session abgelaufen, melde neu an")
+                if self.token_store:
+                    self.token_store.delete(self._csrf_token_name())
+                if not self.login_ct_rest_api(**self._login_kwargs):
+                    raise ChurchtoolsApiError("ChurchTools login failed")
+
     def create_agenda_item(self, event_id: int, item: dict, before_id: int | None = None, after_id: int | None = None):
         params = self._position_params(before_id, after_id)
         return self.post(f"events/{event_id}/agenda/items", item, params=params)
@@ -273,6 +383,62 @@ https://songselect.ccli.com/songs/{new_song['ccli']}""")
         return None
 
 
+class Plan_Churchtools_API(Churchtools_API):
+    """
+    Churchtools_API für den Plan-Modus: Lesende Anfragen gehen an ChurchTools, schreibende werden nur aufgezeichnet.
+    POST/PUT liefern eine Antwort mit negativer Platzhalter-ID, damit die übrigen Code-Pfade unverändert laufen.
+    """
+
+    notify = False
+
+    def __init__(self, *args, **kwargs):
+        self.planned_calls: list[dict] = []
+        self._fake_ids = itertools.count(-1, -1)
+        self._lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def create_song(self, name: str, categoryId: int, author=None, copyright=None, ccli=None):
+        self._record("create_song", name=name, categoryId=categoryId, author=author, copyright=copyright, ccli=ccli)
+        return super().create_song(name, categoryId, author=author, copyright=copyright, ccli=ccli)
+
+    def create_agenda_item(self, event_id: int, item: dict, before_id: int | None = None, after_id: int | None = None):
+        self._record("create_agenda_item", event_id=event_id, item=item, before_id=before_id, after_id=after_id)
+        return super().create_agenda_item(event_id, item, before_id=before_id, after_id=after_id)
+
+    def update_agenda_item(
+        self, event_id: int, item_id: int, item: dict, before_id: int | None = None, after_id: int | None = None
+    ):
+        self._record(
+            "update_agenda_item", event_id=event_id, item_id=item_id, item=item, before_id=before_id, after_id=after_id
+        )
+        return super().update_agenda_item(event_id, item_id, item, before_id=before_id, after_id=after_id)
+
+    def post(self, endpoint: str, data, params=None):
+        logging.debug(f"PLAN POST {endpoint} {params or ''}")
+        with self._lock:
+            fake_id = next(self._fake_ids)
+        response_data = {**data, "id": fake_id}
+        if endpoint == "songs":
+            response_data["arrangements"] = []
+        return {"data": response_data}
+
+    def put(self, endpoint: str, data, params=None):
+        logging.debug(f"PLAN PUT {endpoint} {params or ''}")
+        item_id = endpoint.rsplit("/", 1)[-1]
+        return {"data": {**data, "id": int(item_id) if item_id.isdigit() else item_id}}
+
+    def log_plan(self):
+        for call in self.planned_calls:
+            arguments = ", ".join(f"{key}={json.dumps(value, cls=CustomEncoder)}" for key, value in call["args"].items())
+            logging.info(f"PLAN {call['call']}({arguments})")
+        counts = Counter(call["call"] for call in self.planned_calls)
+        logging.info(f"PLAN {len(self.planned_calls)} schreibende Aufrufe: {dict(counts)}")
+
+    def _record(self, call: str, **kwargs):
+        with self._lock:
+            self.planned_calls.append({"call": call, "args": kwargs})
+
+
 class CustomEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, (datetime, date)):
@@ -0,0 +1,334 @@
+import asyncio
+import contextlib
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import hashlib
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Any, Awaitable, Callable
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import default_instrumentation
+
+IDEMPOTENT_METHODS = {"get", "head", "options", "put", "delete"}
+
+
+class Rate_Limiter:
+    def __init__(self, requests_per_second: float = 0):
+        """
+        Begrenzt die Anfragen je Host auf requests_per_second (0 = unbegrenzt).
+        Nach einem 429 wird der Host zusätzlich bis zum Ablauf von Retry-After gesperrt.
+        """
+        self.requests_per_second = requests_per_second
+        self._lock = threading.Lock()
+        self._next_slot: dict[str, float] = {}
+        self._blocked_until: dict[str, float] = {}
+        self.sleep = time.sleep
+
+    def acquire(self, host: str):
+        delay = self.reserve(host)
+        if delay > 0:
+            self.sleep(delay)
+
+    def reserve(self, host: str) -> float:
+        """Reserviert den nächsten freien Slot für den Host und liefert die Wartezeit bis dahin (für asyncio.sleep)."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._blocked_until.get(host, 0))
+            if self.requests_per_second > 0:
+                start = max(start, self._next_slot.get(host, 0))
+                self._next_slot[host] = start + 1 / self.requests_per_second
+        return start - now
+
+    def block(self, host: str, seconds: float):
+        with self._lock:
+            self._blocked_until[host] = max(self._blocked_until.get(host, 0), time.monotonic() + seconds)
+
+
+class Retry_Policy:
+    def __init__(
+        self,
+        max_retries: int = 4,
+        backoff: float = 0.5,
+        max_backoff: float = 30,
+        retry_statuses: tuple[int, ...] = (429, 500, 502, 503, 504),
+        retry_non_idempotent: bool = False,
+        max_retry_after: float = 300,
+    ):
+        """
+        Wiederholt fehlgeschlagene Anfragen mit exponentiellem Backoff (full jitter) und beachtet Retry-After.
+        Standardmäßig werden nur idempotente Methoden wiederholt, außer bei 429 (und 503 mit Retry-After):
+        Dann hat der Server die Anfrage nicht verarbeitet und auch ein POST kann gefahrlos wiederholt werden.
+        Verlangt der Server mit Retry-After länger als max_retry_after zu warten, wird abgebrochen.
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = retry_statuses
+        self.retry_non_idempotent = retry_non_idempotent
+        self.sleep = time.sleep
+
+    def send(
+        self, method: str, url: str, send: Callable[[], requests.Response], rate_limiter: "Rate_Limiter | None" = None
+    ) -> requests.Response:
+        host = urllib.parse.urlsplit(url).netloc
+        attempt = 0
+        while True:
+            if rate_limiter:
+                rate_limiter.acquire(host)
+            try:
+                response, error = send(), None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, e
+            delay = self.retry_delay(method, url, attempt, response, error, rate_limiter)
+            if delay is None:
+                if error:
+                    raise error
+                return response
+            self.sleep(delay)
+            attempt = attempt + 1
+
+    async def send_async(
+        self,
+        method: str,
+        url: str,
+        send: Callable[[], Awaitable[Any]],
+        rate_limiter: "Rate_Limiter | None" = None,
+        retry_exceptions: tuple[type[BaseException], ...] = (OSError, asyncio.TimeoutError),
+    ):
+        """Wie send, aber für die asynchronen Clients (wartet mit asyncio.sleep)."""
+        host = urllib.parse.urlsplit(url).netloc
+        attempt = 0
+        while True:
+            if rate_limiter:
+                await asyncio.sleep(max(0, rate_limiter.reserve(host)))
+            try:
+                response, error = await send(), None
+            except retry_exceptions as e:
+                response, error = None, e
+            delay = self.retry_delay(method, url, attempt, response, error, rate_limiter)
+            if delay is None:
+                if error:
+                    raise error
+                return response
+            await asyncio.sleep(delay)
+            attempt = attempt + 1
+
+    def retry_delay(
+        self,
+        method: str,
+        url: str,
+        attempt: int,
+        response=None,
+        error: BaseException | None = None,
+        rate_limiter: "Rate_Limiter | None" = None,
+    ) -> float | None:
+        """Wartezeit bis zum nächsten Versuch oder None, wenn nicht (mehr) wiederholt wird."""
+        idempotent = self.retry_non_idempotent or method.lower() in IDEMPOTENT_METHODS
+        if error is not None:
+            if not idempotent or attempt >= self.max_retries:
+                return None
+            delay = self._backoff(attempt)
+            logging.warning(f"{method.upper()} {url} fehlgeschlagen ({error}), neuer Versuch in {delay:.1f}s")
+            return delay
+        if response.status_code not in self.retry_statuses:
+            return None
+        retry_after = self._retry_after(response)
+        delay = retry_after if retry_after is not None else self._backoff(attempt)
+        if response.status_code == 429 and rate_limiter:
+            rate_limiter.block(urllib.parse.urlsplit(url).netloc, delay)
+        not_processed = response.status_code == 429 or (response.status_code == 503 and retry_after is not None)
+        if not (idempotent or not_processed) or attempt >= self.max_retries:
+            return None
+        if retry_after is not None and retry_after > self.max_retry_after:
+            logging.warning(
+                f"{method.upper()} {url} lieferte {response.status_code} mit Retry-After {retry_after:.0f}s, breche ab"
+            )
+            return None
+        logging.warning(f"{method.upper()} {url} lieferte {response.status_code}, neuer Versuch in {delay:.1f}s")
+        return delay
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def _retry_after(self, response: requests.Response) -> float | None:
+        value = response.headers.get("Retry-After") if getattr(response, "headers", None) else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+
+class Pooled_Adapter(HTTPAdapter):
+    """HTTPAdapter, der zählt, wie viele Verbindungen geöffnet und wie oft bestehende wiederverwendet wurden.
+    Latenz und übertragene Bytes jeder Anfrage landen in der default_instrumentation."""
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        if kwargs.get("stream"):
+            bytes_received = int(response.headers.get("Content-Length") or 0)
+        else:
+            bytes_received = len(response.content or b"")
+        body = request.body.encode("utf-8") if isinstance(request.body, str) else request.body
+        default_instrumentation.record_http(
+            request.method,
+            request.url,
+            response.status_code,
+            time.perf_counter() - start,
+            len(body) if isinstance(body, bytes) else 0,
+            bytes_received,
+        )
+        return response
+
+    def connection_stats(self) -> dict[str, int]:
+        opened = 0
+        requests_sent = 0
+        pools = self.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened = opened + pool.num_connections
+                requests_sent = requests_sent + pool.num_requests
+        return {"opened": opened, "reused": max(0, requests_sent - opened)}
+
+
+def create_session(pool_size: int = 10) -> requests.Session:
+    """Session mit Keep-Alive und einem Connection-Pool von pool_size Verbindungen je Host."""
+    session = requests.Session()
+    adapter = Pooled_Adapter(pool_connections=4, pool_maxsize=max(1, pool_size))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def connection_stats(session: requests.Session) -> dict[str, int]:
+    stats = {"opened": 0, "reused": 0}
+    for adapter in set(getattr(session, "adapters", {}).values()):
+        if isinstance(adapter, Pooled_Adapter):
+            for key, value in adapter.connection_stats().items():
+                stats[key] = stats[key] + value
+    return stats
+
+
+class Http_Response_Cache:
+    def __init__(self, directory: str, ttl: float = 0):
+        """
+        Speichert GET-Antworten mit ETag/Last-Modified im Sync-State Verzeichnis für Conditional GETs.
+        Antworten ohne Validatoren werden bis zu ttl Sekunden ohne Anfrage wiederverwendet (0 = nie).
+        """
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def fetch(self, url: str, send: Callable[[dict[str, str]], requests.Response]) -> requests.Response:
+        """
+        GET über den Cache: send bekommt die Conditional-Header und führt die eigentliche Anfrage aus.
+        Bei 304 (oder frischer TTL) wird die gespeicherte Antwort als 200 zurückgegeben.
+        """
+        entry = self.lookup(url)
+        if entry and self.is_fresh(entry):
+            logging.debug("GET %s aus dem Response Cache (TTL)", url)
+            return self._cached_response(url, entry)
+        response = send(self.request_headers(entry))
+        if response.status_code == 304 and entry:
+            logging.debug("GET %s nicht geändert (304)", url)
+            self.revalidated(url, entry)
+            return self._cached_response(url, entry)
+        if response.status_code == 200:
+            self.store(url, response)
+        return response
+
+    def lookup(self, url: str) -> dict | None:
+        try:
+            with open(self._file_path(url), "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        return entry if entry.get("url") == url else None
+
+    def is_fresh(self, entry: dict) -> bool:
+        """Ohne Validatoren kann nur per TTL entschieden werden, ob die Antwort noch verwendet wird."""
+        if entry.get("etag") or entry.get("last_modified"):
+            return False
+        return time.time() - entry["stored_at"] < self.ttl
+
+    def request_headers(self, entry: dict | None) -> dict[str, str]:
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url: str, response: requests.Response):
+        headers = getattr(response, "headers", None) or {}
+        entry = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "stored_at": time.time(),
+            "body": response.text,
+        }
+        if entry["etag"] or entry["last_modified"] or self.ttl > 0:
+            self._write(url, entry)
+
+    def revalidated(self, url: str, entry: dict):
+        """Nach einem 304 zählt die TTL wieder ab jetzt."""
+        self._write(url, {**entry, "stored_at": time.time()})
+
+    def invalidate(self, url: str):
+        """Verwirft alle gespeicherten Antworten für den Pfad der URL (unabhängig von Query-Parametern)."""
+        path_directory = os.path.join(self.directory, self._path_hash(url))
+        try:
+            file_names = os.listdir(path_directory)
+        except FileNotFoundError:
+            return
+        for file_name in file_names:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(path_directory, file_name))
+
+    def _cached_response(self, url: str, entry: dict) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.encoding = "utf-8"
+        response._content = entry["body"].encode("utf-8")
+        return response
+
+    def _write(self, url: str, entry: dict):
+        file_path = self._file_path(url)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # Temporäre Datei außerhalb der Pfad-Verzeichnisse, damit invalidate keine halb geschriebene Datei entfernt
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, file_path)
+
+    def _file_path(self, url: str) -> str:
+        """Ein Verzeichnis je Pfad, damit invalidate nur die Antworten dieses Pfads auflisten muss."""
+        query_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, self._path_hash(url), f"{query_hash}.json")
+
+    def _path_hash(self, url: str) -> str:
+        path = urllib.parse.urlsplit(url)._replace(query="", fragment="").geturl()
+        return hashlib.sha256(path.encode("utf-8")).hexdigest()[:16]
+
+
+# Gemeinsamer Rate Limiter für alle Clients, damit sich Anfragen an denselben Host die Grenze teilen
+default_rate_limiter = Rate_Limiter()
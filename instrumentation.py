@@ -0,0 +1,120 @@
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import re
+import threading
+import time
+import urllib.parse
+
+# Obergrenzen der Latenz-Buckets in Sekunden, der letzte Bucket (+Inf) kommt implizit dazu
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_ID_SEGMENT = re.compile(r"/(?:\d+|[0-9a-f]{8,}(?:-[0-9a-f]{4,})*)(?=/|$)")
+# Telegram Bot API: der Token steht im Pfad (/bot<token>/sendMessage)
+_BOT_TOKEN_SEGMENT = re.compile(r"^/bot[^/]+")
+
+
+def endpoint_name(url: str) -> str:
+    """
+    Pfad ohne Query, IDs werden durch {id} ersetzt, damit z.B. alle Agenden ein Endpunkt sind.
+    Ein Bot-Token im Pfad wird durch {token} ersetzt, er darf weder in Logs noch in Metriken landen.
+    """
+    path = _BOT_TOKEN_SEGMENT.sub("/bot{token}", urllib.parse.urlsplit(url).path)
+    return _ID_SEGMENT.sub("/{id}", path)
+
+
+def host_name(url: str) -> str:
+    """Host (mit Port) ohne eventuelle Zugangsdaten aus der URL."""
+    return urllib.parse.urlsplit(url).netloc.rpartition("@")[2]
+
+
+class Instrumentation:
+    def __init__(self):
+        """Sammelt Laufzeiten je Sync-Phase sowie Latenzen und übertragene Bytes je HTTP-Endpunkt."""
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = datetime.now(timezone.utc)
+            self.phases: dict[str, dict[str, float]] = {}
+            self.http: dict[tuple[str, str, str], dict] = {}
+            self.status_codes: Counter[tuple[str, int]] = Counter()
+            self.counters: Counter[str] = Counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.perf_counter() - start)
+
+    def record_phase(self, name: str, seconds: float):
+        with self._lock:
+            phase = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+            phase["seconds"] += seconds
+            phase["calls"] += 1
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def record_http(
+        self, method: str, url: str, status_code: int, seconds: float, bytes_sent: int = 0, bytes_received: int = 0
+    ):
+        host = host_name(url)
+        key = (host, method.upper(), endpoint_name(url))
+        with self._lock:
+            stats = self.http.setdefault(
+                key,
+                {
+                    "count": 0,
+                    "seconds": 0.0,
+                    "bytes_sent": 0,
+                    "bytes_received": 0,
+                    "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+                },
+            )
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["bytes_sent"] += bytes_sent
+            stats["bytes_received"] += bytes_received
+            stats["buckets"][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.status_codes[(host, status_code)] += 1
+
+    def summary(self) -> dict:
+        """JSON-fähige Zusammenfassung seit dem letzten reset()."""
+        with self._lock:
+            bucket_names = [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+            status_codes: dict[str, dict[str, int]] = {}
+            for (host, status_code), count in sorted(self.status_codes.items()):
+                status_codes.setdefault(host, {})[str(status_code)] = count
+            return {
+                "started": self.started.isoformat(),
+                "duration_seconds": round((datetime.now(timezone.utc) - self.started).total_seconds(), 3),
+                "phases": {
+                    name: {"seconds": round(phase["seconds"], 4), "calls": phase["calls"]}
+                    for name, phase in self.phases.items()
+                },
+                "http": [
+                    {
+                        "host": host,
+                        "method": method,
+                        "endpoint": endpoint,
+                        "count": stats["count"],
+                        "seconds": round(stats["seconds"], 4),
+                        "bytes_sent": stats["bytes_sent"],
+                        "bytes_received": stats["bytes_received"],
+                        "latency_buckets": dict(zip(bucket_names, stats["buckets"])),
+                    }
+                    for (host, method, endpoint), stats in sorted(self.http.items())
+                ],
+                "status_codes": status_codes,
+                "counters": dict(self.counters),
+            }
+
+
+# Gemeinsame Instanz für Clients und Sync-Durchlauf
+default_instrumentation = Instrumentation()
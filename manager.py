@@ -1,5 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+from typing import Literal, TypedDict
+
 from churchtools_api import Churchtools_API
 from custom_types import CT_Song, Config, Config_Song_Placement, WT_Song
+from instrumentation import default_instrumentation
 from matcher import Song_Matcher
 from utils import slice_list
 
@@ -8,18 +15,67 @@ class AgendaException(Exception):
     pass
 
 
+class Agenda_Operation(TypedDict):
+    type: Literal["create", "update", "keep"]
+    item: dict
+    current_item: dict | None
+    payload: dict
+    song: CT_Song
+
+
+class CT_Agenda_Store:
+    def __init__(self, ct_api: Churchtools_API, max_workers: int = 4):
+        """Lädt die Agenden mehrerer Events vorab und parallel, getrennt von der Platzierungslogik."""
+        self.ct_api = ct_api
+        self.max_workers = max_workers
+        self.agendas: dict[int, dict | None] = {}
+        self.fetch_seconds: dict[int, float] = {}
+
+    def prefetch(self, ct_event_ids: list[int]):
+        missing_ids = [ct_event_id for ct_event_id in dict.fromkeys(ct_event_ids) if ct_event_id not in self.agendas]
+        if not missing_ids:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing_ids))) as executor:
+            for ct_event_id, agenda in zip(missing_ids, executor.map(self._fetch, missing_ids)):
+                self.agendas[ct_event_id] = agenda
+
+    def get(self, ct_event_id: int) -> dict | None:
+        if ct_event_id not in self.agendas:
+            self.agendas[ct_event_id] = self._fetch(ct_event_id)
+        return self.agendas[ct_event_id]
+
+    def _fetch(self, ct_event_id: int) -> dict | None:
+        start = time.perf_counter()
+        res = self.ct_api.get(f"events/{ct_event_id}/agenda")
+        self.fetch_seconds[ct_event_id] = time.perf_counter() - start
+        logging.debug(f"Agenda für Event {ct_event_id} in {self.fetch_seconds[ct_event_id]:.3f}s geladen")
+        return res["data"] if res else None
+
+
 class CT_Event_Manager:
-    def __init__(self, ct_api: Churchtools_API, config: Config, ct_event_id: int):
+    def __init__(self, ct_api: Churchtools_API, config: Config, ct_event_id: int, ct_agenda: dict | None = None):
+        """
+        :param ct_agenda: Bereits geladene Agenda (z.B. aus dem CT_Agenda_Store), sonst wird sie hier geladen.
+        """
         self.ct_api = ct_api
         self.config = config
         self.ct_event_id = ct_event_id
-        res = self.ct_api.get(f"events/{self.ct_event_id}/agenda")
-        if res:
-            self.ct_agenda = res["data"]
-        else:
+        if ct_agenda is None:
+            res = self.ct_api.get(f"events/{self.ct_event_id}/agenda")
+            ct_agenda = res["data"] if res else None
+        if ct_agenda is None:
             raise AgendaException(f"No Agenda found for event {self.ct_event_id}!")
+        self.ct_agenda = ct_agenda
 
     def place_songs(self, songs: list[CT_Song], song_placements: list[Config_Song_Placement]):
+        planned_items, operations = self.plan_songs(songs, song_placements)
+        self.apply_operations(planned_items, operations)
+
+    def plan_songs(self, songs: list[CT_Song], song_placements: list[Config_Song_Placement]):
+        """
+        Berechnet die gewünschte Agenda, ohne die API aufzurufen.
+        Liefert die geplanten Items und die geordnete Liste der nötigen Operationen (create, update oder keep).
+        """
         sort_placements = []
         for song_placement in song_placements:
             position = self.find_song_placement(song_placement)
@@ -30,41 +86,76 @@ class CT_Event_Manager:
             sort_placements.append({"position": position, "songs": placement_songs})
         placements = sorted(sort_placements, key=lambda p: p["position"])
 
-        def place_placement(placement, position_correction: int):
+        planned_items = list(self.ct_agenda.setdefault("items", []))
+        operations: list[Agenda_Operation] = []
+        position_correction = 0
+        for placement in placements:
             count_new = 0
             for i, song in enumerate(placement["songs"]):
-                if self.place_song(song, placement["position"] + i + position_correction):
+                operation = self.plan_song(planned_items, song, placement["position"] + i + position_correction)
+                operations.append(operation)
+                if operation["type"] == "create":
                     count_new = count_new + 1
-            return count_new
-
-        position_correction = 0
-        for placement in placements:
-            position_correction = place_placement(placement, position_correction) + position_correction
+            position_correction = position_correction + count_new
+        return planned_items, operations
 
-    def place_song(self, ct_song: CT_Song, position: int, position_correction: int = 0) -> bool:
-        items = self.ct_agenda.setdefault("items", [])
+    def plan_song(self, planned_items: list[dict], ct_song: CT_Song, position: int) -> Agenda_Operation:
         target_position = max(0, position)
-        target_item = items[target_position] if target_position < len(items) else None
+        target_item = planned_items[target_position] if target_position < len(planned_items) else None
         payload = self.build_song_item_payload(ct_song)
 
         if target_item and target_item["type"] == "song":
             if target_item.get("song", {}).get("songId") == ct_song["id"]:
-                return False
-            response = self.ct_api.update_agenda_item(self.ct_event_id, target_item["id"], payload)
-            if response:
-                items[target_position] = self.build_local_agenda_item(response, payload, ct_song, target_item)
-                self.update_agenda_positions()
-            return False
-
-        before_id = target_item["id"] if target_item else None
-        after_id = None if before_id or not items else items[-1]["id"]
-        response = self.ct_api.create_agenda_item(self.ct_event_id, payload, before_id=before_id, after_id=after_id)
-        if not response:
-            return False
-
-        items.insert(target_position, self.build_local_agenda_item(response, payload, ct_song))
+                return {"type": "keep", "item": target_item, "current_item": target_item, "payload": payload, "song": ct_song}
+            item = self.build_local_agenda_item(None, payload, ct_song, target_item)
+            planned_items[target_position] = item
+            return {"type": "update", "item": item, "current_item": target_item, "payload": payload, "song": ct_song}
+
+        # Noch nicht angelegte Items haben keine id, sie werden erst beim Ausführen verankert
+        item = self.build_local_agenda_item(None, payload, ct_song)
+        planned_items.insert(target_position, item)
+        return {"type": "create", "item": item, "current_item": None, "payload": payload, "song": ct_song}
+
+    def apply_operations(self, planned_items: list[dict], operations: list[Agenda_Operation]) -> int:
+        """Führt die geplanten Operationen der Reihe nach aus und setzt die Positionen einmalig am Ende."""
+        count_new = 0
+        for operation in operations:
+            item = operation["item"]
+            if operation["type"] == "update":
+                current_item = operation["current_item"]
+                response = self.ct_api.update_agenda_item(self.ct_event_id, current_item["id"], operation["payload"])
+                index = self._index_of(planned_items, item)
+                if response:
+                    planned_items[index] = self.build_local_agenda_item(
+                        response, operation["payload"], operation["song"], current_item
+                    )
+                else:
+                    planned_items[index] = current_item
+            elif operation["type"] == "create":
+                index = self._index_of(planned_items, item)
+                before_id = next((i["id"] for i in planned_items[index + 1 :] if "id" in i), None)
+                after_id = None
+                if before_id is None:
+                    after_id = next((i["id"] for i in reversed(planned_items[:index]) if "id" in i), None)
+                response = self.ct_api.create_agenda_item(
+                    self.ct_event_id, operation["payload"], before_id=before_id, after_id=after_id
+                )
+                if response:
+                    item.update(self.build_local_agenda_item(response, operation["payload"], operation["song"]))
+                    count_new = count_new + 1
+                else:
+                    del planned_items[index]
+        self.ct_agenda["items"] = planned_items
         self.update_agenda_positions()
-        return True
+        return count_new
+
+    def place_song(self, ct_song: CT_Song, position: int, position_correction: int = 0) -> bool:
+        planned_items = list(self.ct_agenda.setdefault("items", []))
+        operation = self.plan_song(planned_items, ct_song, position)
+        return self.apply_operations(planned_items, [operation]) == 1
+
+    def _index_of(self, items: list[dict], item: dict) -> int:
+        return next(index for index, current in enumerate(items) if current is item)
 
     def build_song_item_payload(self, ct_song: CT_Song) -> dict:
         item = {
@@ -123,26 +214,32 @@ class CT_Song_Manager:
         self.ct_api = ct_api
         self.config = config
         self.song_matcher = song_matcher
+        # Serialisiert Abgleich und Anlegen, damit parallel synchronisierte Events einen Song nicht doppelt anlegen
+        self._lock = threading.Lock()
 
     def convert(self, wt_song_ids: list[str]):
         ct_songs: list[CT_Song] = []
         for wt_song_id in wt_song_ids:
             ct_song = self.song_matcher.match(wt_song_id)
             if not ct_song:
-                wt_song = self.song_matcher.find_wt_song({"id": wt_song_id})
-                if wt_song:
-                    ct_song = self.create_ct_song(wt_song)
+                with self._lock:
+                    ct_song = self.song_matcher.match(wt_song_id)
+                    wt_song = self.song_matcher.find_wt_song({"id": wt_song_id})
+                    if not ct_song and wt_song:
+                        ct_song = self.create_ct_song(wt_song)
             if ct_song:
                 ct_songs.append(ct_song)
         return ct_songs
 
     def create_ct_song(self, wt_song: WT_Song | None) -> CT_Song:
-        new_song = self.ct_api.create_song(
-            name=wt_song["name"],
-            categoryId=self.config["ct_song_defaults"]["songcategory_id"],
-            author=wt_song["artist"],
-            ccli=wt_song["ccli"],
-        )
+        with default_instrumentation.phase("song_creation"):
+            new_song = self.ct_api.create_song(
+                name=wt_song["name"],
+                categoryId=self.config["ct_song_defaults"]["songcategory_id"],
+                author=wt_song["artist"],
+                ccli=wt_song["ccli"],
+            )
         if new_song:
+            default_instrumentation.count("songs_created")
             self.song_matcher.add_ct_song(new_song)
         return new_song
@@ -1,6 +1,7 @@
+from collections import Counter
 from datetime import datetime, timezone
 import re
-from typing import TypedDict, Union
+from typing import Callable, Iterable, TypedDict, Union
 from zoneinfo import ZoneInfo
 from custom_types import CT_Event, CT_Song, Config, Config_CT_Event, WT_Event, WT_Song
 from utils import parse_datetime
@@ -16,6 +17,9 @@ class Event_Config_Match(Event_Match):
     config: Config_CT_Event
 
 
+Event_Rule = tuple[Callable[[str], object], Config_CT_Event]
+
+
 class Event_Matcher:
     wt_time_formats = ["%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M"]
 
@@ -23,53 +27,83 @@ class Event_Matcher:
         self.ct_tzinfo = ZoneInfo(ct_tz)
         self.wt_tzinfo = ZoneInfo(wt_tz)
         self.config = config
+        self._compile_rules(config["ct_events"])
 
     def match_by_time(self, wt_events: list[WT_Event], ct_events: list[CT_Event]):
+        wt_events_by_start = self._index_by_start(wt_events)
         matches: list[Event_Match] = []
         for ct_event in ct_events:
-            ct_event_start = datetime.strptime(ct_event["startDate"], "%Y-%m-%dT%H:%M:%SZ").replace(
-                tzinfo=timezone.utc
-            ).astimezone(self.ct_tzinfo)
-            for wt_event in wt_events:
-                for wt_event_time in wt_event["times"]:
-                    wt_event_start = (
-                        parse_datetime(wt_event_time, self.wt_time_formats)
-                        .replace(tzinfo=self.wt_tzinfo)
-                        .astimezone(self.ct_tzinfo)
-                    )
-                    if wt_event_start == ct_event_start:
-                        matches.append({"ct": ct_event, "wt": wt_event, "time": ct_event_start})
+            ct_event_start = datetime.strptime(ct_event["startDate"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+            for wt_event in wt_events_by_start.get(ct_event_start, []):
+                matches.append({"ct": ct_event, "wt": wt_event, "time": ct_event_start.astimezone(self.ct_tzinfo)})
         return matches
 
+    def _index_by_start(self, wt_events: list[WT_Event]) -> dict[datetime, list[WT_Event]]:
+        """Gruppiert die WT Events nach ihren Startzeiten (als UTC Zeitpunkt)."""
+        wt_events_by_start: dict[datetime, list[WT_Event]] = {}
+        for wt_event in wt_events:
+            for wt_event_time in wt_event["times"]:
+                wt_event_start = (
+                    parse_datetime(wt_event_time, self.wt_time_formats)
+                    .replace(tzinfo=self.wt_tzinfo)
+                    .astimezone(timezone.utc)
+                )
+                wt_events_by_start.setdefault(wt_event_start, []).append(wt_event)
+        return wt_events_by_start
+
     def match(self, wt_events: list[WT_Event], ct_events: list[CT_Event]):
         matches: list[Union[Event_Config_Match]] = []
         events = self.match_by_time(wt_events, ct_events)
         for event in events:
             if event["wt"]["songs"]:
-                ct_event_config = None
-                for ct_event in self.config["ct_events"]:
-                    if "campus_name" in ct_event and ct_event["campus_name"]:
-                        if event["ct"]["calendar"]["domainAttributes"]["campusName"] != ct_event["campus_name"]:
-                            continue
-                    if "regex" in ct_event and ct_event["regex"]:
-                        regex = re.compile(ct_event["regex"])
-                        if regex.search(event["ct"]["name"]):
-                            ct_event_config = ct_event
-                            break
-                    else:
-                        if ct_event["name"] in event["ct"]["name"]:
-                            ct_event_config = ct_event
-                            break
+                ct_event_config = self.classify(event["ct"])
                 if ct_event_config:
                     event["config"] = ct_event_config
                     matches.append(event)
         return matches
 
+    def classify(self, ct_event: CT_Event) -> Config_CT_Event | None:
+        """Liefert die erste passende Event-Konfiguration für das ChurchTools Event."""
+        rules = self.campus_independent_rules
+        if self.rules_by_campus:
+            campus_name = ct_event.get("calendar", {}).get("domainAttributes", {}).get("campusName")
+            rules = self.rules_by_campus.get(campus_name, rules)
+        for is_match, ct_event_config in rules:
+            if is_match(ct_event["name"]):
+                return ct_event_config
+        return None
+
+    def _compile_rules(self, ct_event_configs: list[Config_CT_Event]):
+        """Kompiliert die Event-Konfigurationen einmalig in Campus-Buckets (Reihenfolge bleibt erhalten)."""
+        rules: list[tuple[str | None, Event_Rule]] = []
+        for ct_event_config in ct_event_configs:
+            if ct_event_config.get("regex"):
+                is_match = re.compile(ct_event_config["regex"]).search
+            else:
+                is_match = lambda name, needle=ct_event_config["name"]: needle in name
+            rules.append((ct_event_config.get("campus_name") or None, (is_match, ct_event_config)))
+
+        self.campus_independent_rules = [rule for campus_name, rule in rules if campus_name is None]
+        self.rules_by_campus: dict[str, list[Event_Rule]] = {}
+        for campus in dict.fromkeys(campus_name for campus_name, _ in rules if campus_name is not None):
+            self.rules_by_campus[campus] = [rule for campus_name, rule in rules if campus_name in (None, campus)]
+
 
 class Song_Matcher:
-    def __init__(self, wt_songs: list[WT_Song], ct_songs: list[CT_Song]):
-        self.wt_songs = wt_songs
-        self.ct_songs = ct_songs
+    wt_index_keys = [("id",)]
+    ct_index_keys = [("id",), ("ccli",), ("name", "author")]
+
+    def __init__(self, wt_songs: Iterable[WT_Song], ct_songs: Iterable[CT_Song]):
+        """Die Songs können auch als Stream (z.B. iter_all) übergeben werden, die Indizes werden beim Lesen aufgebaut."""
+        self.wt_songs: list[WT_Song] = []
+        self.ct_songs: list[CT_Song] = []
+        self.wt_index: dict[tuple[str, ...], dict[tuple, WT_Song]] = {keys: {} for keys in self.wt_index_keys}
+        self.ct_index: dict[tuple[str, ...], dict[tuple, CT_Song]] = {keys: {} for keys in self.ct_index_keys}
+        self.index_hits: Counter[str] = Counter()
+        for wt_song in wt_songs:
+            self.add_wt_song(wt_song)
+        for ct_song in ct_songs:
+            self.add_ct_song(ct_song)
 
     def match(self, wt_song_id: str):
         wt_song = self.find_wt_song({"id": wt_song_id})
@@ -82,26 +116,41 @@ class Song_Matcher:
             return ct_song
 
     def find_wt_song(self, filter: dict[str, any]):
-        for wt_song in self.wt_songs:
-            match = True
-            for key, value in filter.items():
-                if wt_song[key] != value:
-                    match = False
-                    break
-            if match:
-                return wt_song
-        return None
+        return self._find("wt", self.wt_songs, self.wt_index, filter)
 
     def find_ct_song(self, filter: dict[str, any]):
-        for ct_song in self.ct_songs:
+        return self._find("ct", self.ct_songs, self.ct_index, filter)
+
+    def add_wt_song(self, new_wt_song: WT_Song):
+        self.wt_songs.append(new_wt_song)
+        self._index_song(self.wt_index, new_wt_song)
+
+    def add_ct_song(self, new_ct_song: CT_Song):
+        self.ct_songs.append(new_ct_song)
+        self._index_song(self.ct_index, new_ct_song)
+
+    def lookup_stats(self) -> dict[str, int]:
+        """Anzahl der Lookups je Index, z.B. {"ct:ccli": 12, "ct:scan": 1}."""
+        return dict(self.index_hits)
+
+    def _index_song(self, index: dict[tuple[str, ...], dict[tuple, dict]], song: dict):
+        for keys, entries in index.items():
+            # Der erste Song gewinnt, wie beim bisherigen linearen Durchlauf
+            entries.setdefault(tuple(song.get(key) for key in keys), song)
+
+    def _find(self, side: str, songs: list[dict], index: dict[tuple[str, ...], dict[tuple, dict]], filter: dict[str, any]):
+        keys = tuple(sorted(filter))
+        for index_keys, entries in index.items():
+            if tuple(sorted(index_keys)) == keys:
+                self.index_hits[f"{side}:{'+'.join(index_keys)}"] += 1
+                return entries.get(tuple(filter[key] for key in index_keys))
+        self.index_hits[f"{side}:scan"] += 1
+        for song in songs:
             match = True
             for key, value in filter.items():
-                if ct_song[key] != value:
+                if song[key] != value:
                     match = False
                     break
             if match:
-                return ct_song
+                return song
         return None
-
-    def add_ct_song(self, new_ct_song: CT_Song):
-        self.ct_songs.append(new_ct_song)
@@ -0,0 +1,212 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from instrumentation import LATENCY_BUCKETS, endpoint_name
+
+if TYPE_CHECKING:
+    from cache import Database
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "wt_ct_sync_"
+
+# Zähler aus Instrumentation.counters, die als Prometheus Counter exportiert werden
+COUNTERS = {
+    "events_matched": "Events, die einem Worshiptools Service und einer Konfiguration zugeordnet wurden",
+    "events_skipped_cached": "Events, die laut Cache bereits synchronisiert sind",
+    "agenda_exceptions": "Events, die wegen einer AgendaException nicht synchronisiert werden konnten",
+    "songs_created": "In ChurchTools angelegte Songs",
+}
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels: str) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class Metrics_Exporter:
+    state_key = "metrics"
+
+    def __init__(self, db: "Database | None" = None):
+        """
+        Summiert die Zusammenfassungen der Sync-Durchläufe (Instrumentation.summary) zu Prometheus Metriken.
+        Counter laufen über alle Durchläufe weiter, Gauges zeigen den letzten Durchlauf.
+        Mit db werden Counter und der letzte Erfolg im Sync-State gespeichert, damit sie auch bei einzelnen
+        Aufrufen per Cron (Textfile Collector) weiter steigen.
+        """
+        self.db = db
+        self._lock = threading.Lock()
+        self.counters: dict[str, float] = {name: 0 for name in COUNTERS}
+        self.runs: dict[str, int] = {"success": 0, "error": 0}
+        self.http_status: dict[tuple[str, str], int] = {}
+        self.http_latency: dict[tuple[str, str, str], dict] = {}
+        self.phase_seconds: dict[str, float] = {}
+        self.cache_size = 0
+        self.last_run_seconds = 0.0
+        self.last_success = 0.0
+        if db is not None:
+            self._load_state(db.get(self.state_key) or {})
+
+    def record_run(self, summary: dict, succeeded: bool, cache_size: int):
+        with self._lock:
+            for name, value in summary.get("counters", {}).items():
+                if name in self.counters:
+                    self.counters[name] += value
+            self.runs["success" if succeeded else "error"] += 1
+            for host, status_codes in summary.get("status_codes", {}).items():
+                for status_code, count in status_codes.items():
+                    key = (host, status_code)
+                    self.http_status[key] = self.http_status.get(key, 0) + count
+            for http in summary.get("http", []):
+                key = (http["host"], http["method"], http["endpoint"])
+                latency = self.http_latency.setdefault(
+                    key, {"count": 0, "seconds": 0.0, "buckets": [0] * (len(LATENCY_BUCKETS) + 1)}
+                )
+                latency["count"] += http["count"]
+                latency["seconds"] += http["seconds"]
+                for i, count in enumerate(http["latency_buckets"].values()):
+                    latency["buckets"][i] += count
+            self.phase_seconds = {name: phase["seconds"] for name, phase in summary.get("phases", {}).items()}
+            self.cache_size = cache_size
+            self.last_run_seconds = summary.get("duration_seconds", 0.0)
+            if succeeded:
+                self.last_success = time.time()
+            if self.db is not None:
+                self.db.insert(self.state_key, self._state())
+
+    def _state(self) -> dict:
+        """JSON/YAML-fähiger Stand der Counter (ohne die Gauges des letzten Durchlaufs)."""
+        return {
+            "counters": dict(self.counters),
+            "runs": dict(self.runs),
+            "http_status": [[host, code, count] for (host, code), count in self.http_status.items()],
+            "http_latency": [
+                {"host": host, "method": method, "endpoint": endpoint, **latency}
+                for (host, method, endpoint), latency in self.http_latency.items()
+            ],
+            "last_success": self.last_success,
+        }
+
+    def _load_state(self, state: dict):
+        for name, value in state.get("counters", {}).items():
+            if name in self.counters:
+                self.counters[name] = value
+        self.runs.update(state.get("runs", {}))
+        for host, code, count in state.get("http_status", []):
+            self.http_status[(host, code)] = count
+        for latency in state.get("http_latency", []):
+            if len(latency["buckets"]) == len(LATENCY_BUCKETS) + 1:
+                # Erneut normalisieren, damit auch früher gespeicherte Pfade keine Tokens enthalten
+                key = (latency["host"], latency["method"], endpoint_name(latency["endpoint"]))
+                merged = self.http_latency.setdefault(
+                    key, {"count": 0, "seconds": 0.0, "buckets": [0] * (len(LATENCY_BUCKETS) + 1)}
+                )
+                merged["count"] += latency["count"]
+                merged["seconds"] += latency["seconds"]
+                merged["buckets"] = [a + b for a, b in zip(merged["buckets"], latency["buckets"])]
+        self.last_success = state.get("last_success", 0.0)
+
+    def render(self) -> str:
+        """Prometheus Text-Format (0.0.4), das auch der node_exporter Textfile Collector liest."""
+        lines: list[str] = []
+
+        def metric(name: str, metric_type: str, help_text: str, samples: list[tuple[str, str, float]]):
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}{name} {metric_type}")
+            lines.extend(f"{PREFIX}{sample_name}{labels} {value}" for sample_name, labels, value in samples)
+
+        with self._lock:
+            for name, help_text in COUNTERS.items():
+                metric(f"{name}_total", "counter", help_text, [(f"{name}_total", "", self.counters[name])])
+            metric(
+                "runs_total",
+                "counter",
+                "Sync-Durchläufe nach Ergebnis",
+                [("runs_total", _labels(result=result), count) for result, count in self.runs.items()],
+            )
+            metric(
+                "http_responses_total",
+                "counter",
+                "HTTP Antworten nach Host und Statuscode",
+                [
+                    ("http_responses_total", _labels(host=host, code=code), count)
+                    for (host, code), count in sorted(self.http_status.items())
+                ],
+            )
+            histogram_samples = []
+            for (host, method, endpoint), latency in sorted(self.http_latency.items()):
+                cumulative = 0
+                for bound, count in zip([*map(str, LATENCY_BUCKETS), "+Inf"], latency["buckets"]):
+                    cumulative += count
+                    labels = _labels(host=host, method=method, endpoint=endpoint, le=bound)
+                    histogram_samples.append(("http_request_duration_seconds_bucket", labels, cumulative))
+                labels = _labels(host=host, method=method, endpoint=endpoint)
+                histogram_samples.append(("http_request_duration_seconds_sum", labels, latency["seconds"]))
+                histogram_samples.append(("http_request_duration_seconds_count", labels, latency["count"]))
+            metric("http_request_duration_seconds", "histogram", "Dauer der HTTP Anfragen", histogram_samples)
+            metric(
+                "phase_duration_seconds",
+                "gauge",
+                "Dauer der Phasen im letzten Sync-Durchlauf",
+                [
+                    ("phase_duration_seconds", _labels(phase=phase), seconds)
+                    for phase, seconds in sorted(self.phase_seconds.items())
+                ],
+            )
+            metric(
+                "last_run_duration_seconds",
+                "gauge",
+                "Dauer des letzten Sync-Durchlaufs",
+                [("last_run_duration_seconds", "", self.last_run_seconds)],
+            )
+            # Ohne bisherigen Erfolg kein Sample, 0 würde als Erfolg im Jahr 1970 gelesen
+            metric(
+                "last_success_timestamp_seconds",
+                "gauge",
+                "Unix-Zeitpunkt des letzten erfolgreichen Sync-Durchlaufs",
+                [("last_success_timestamp_seconds", "", self.last_success)] if self.last_success else [],
+            )
+            metric("cache_entries", "gauge", "Einträge im Sync-Cache", [("cache_entries", "", self.cache_size)])
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, file_path: str):
+        """Schreibt die Metriken atomar (für den Textfile Collector, der keine halben Dateien lesen darf)."""
+        directory = os.path.dirname(os.path.abspath(file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write(self.render())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
+
+    def serve(self, port: int, host: str = "") -> ThreadingHTTPServer:
+        """Startet einen HTTP Server im Hintergrund, der die Metriken unter /metrics ausliefert."""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info(f"Metriken unter http://{host or '0.0.0.0'}:{server.server_port}/metrics")
+        return server
@@ -1,18 +1,26 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import logging
 import os
 import sys
+import time
 import traceback
 import yaml
 from dotenv import load_dotenv
-from cache import Cacher, YamlDatabase
-from manager import AgendaException, CT_Event_Manager, CT_Song_Manager
+from cache import Cacher, Database, Song_Library_Cacher, SqliteDatabase, YamlDatabase, migrate_yaml_to_sqlite
+from http_client import Http_Response_Cache, connection_stats, default_rate_limiter
+from instrumentation import default_instrumentation
+from manager import AgendaException, CT_Agenda_Store, CT_Event_Manager, CT_Song_Manager
 from custom_types import Config
-from matcher import Event_Matcher, Song_Matcher
+from matcher import Event_Config_Match, Event_Matcher, Song_Matcher
+from metrics import Metrics_Exporter
 from telegram import send_telegram_message
+from token_store import Token_Store
 from worshiptools_api import Worshiptools_API
-from churchtools_api import Churchtools_API
+from churchtools_api import Churchtools_API, Plan_Churchtools_API
 import io
+import json
 
 log_stream = io.StringIO()
 
@@ -22,8 +30,66 @@ def main():
     parser = argparse.ArgumentParser(description="Worshiptools ↔️ Churchtools Sync")
     parser.add_argument("--loglevel", default="INFO", help="Setzt das Loglevel (DEBUG, INFO, WARNING, ERROR, CRITICAL)")
     parser.add_argument("--config", default="config.yaml", help="Pfad zur Konfigurationsdatei")
-    parser.add_argument("--db", default="db.yaml", help="Pfad zur Yaml DB Datei")
+    parser.add_argument("--db", help="Pfad zur DB Datei (Standard: db.yaml bzw. db.sqlite mit --db-backend sqlite)")
+    parser.add_argument("--db-backend", choices=["yaml", "sqlite"], default="yaml", help="Speicherformat der DB Datei")
+    parser.add_argument(
+        "--migrate-from", help="Pfad zu einer bestehenden Yaml DB Datei, die einmalig in die SQLite DB übernommen wird"
+    )
+    parser.add_argument(
+        "--song-cache-ttl",
+        type=float,
+        default=24,
+        help="Stunden, nach denen die gecachten Song-Kataloge vollständig neu geladen werden (0 deaktiviert den Cache)",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Zeigt nur an, welche schreibenden ChurchTools Aufrufe ausgeführt würden, ohne sie zu senden "
+        "und ohne die DB Datei zu verändern",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Anzahl der Events, die parallel synchronisiert werden (Standard: 1)"
+    )
+    parser.add_argument(
+        "--daemon", action="store_true", help="Läuft dauerhaft und synchronisiert im Abstand von --interval Sekunden"
+    )
+    parser.add_argument("--interval", type=float, default=300, help="Sekunden zwischen zwei Durchläufen im Daemon-Modus")
+    parser.add_argument(
+        "--rate-limit", type=float, default=0, help="Maximale Anfragen pro Sekunde je Host (0 = unbegrenzt)"
+    )
+    parser.add_argument(
+        "--weeks",
+        type=int,
+        default=12,
+        help="Anzahl der Wochen ab heute, für die Services und Events abgefragt werden (Standard: 12)",
+    )
+    parser.add_argument(
+        "--http-cache",
+        action="store_true",
+        help="Speichert GET-Antworten neben der DB Datei und fragt sie per ETag/Last-Modified erneut an",
+    )
+    parser.add_argument(
+        "--http-cache-ttl",
+        type=float,
+        default=0,
+        help="Sekunden, die Antworten ohne ETag/Last-Modified ungeprüft wiederverwendet werden (Standard: 0)",
+    )
+    parser.add_argument(
+        "--stats-file", help="Schreibt die JSON-Zusammenfassung (Phasen, HTTP-Latenzen) jedes Durchlaufs in diese Datei"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Stellt Prometheus Metriken unter http://0.0.0.0:PORT/metrics bereit (z.B. mit --daemon)",
+    )
+    parser.add_argument(
+        "--metrics-file", help="Schreibt die Prometheus Metriken nach jedem Durchlauf in diese Datei (Textfile Collector)"
+    )
     args = parser.parse_args()
+    if not args.db:
+        args.db = "db.sqlite" if args.db_backend == "sqlite" else "db.yaml"
+    if args.migrate_from and os.path.abspath(args.migrate_from) == os.path.abspath(args.db):
+        parser.error("--migrate-from und --db müssen auf unterschiedliche Dateien zeigen")
 
     # Loglevel einstellen
     log_level = getattr(logging, args.loglevel.upper(), None)
@@ -47,37 +113,197 @@ def main():
         logging.error(f"Fehler beim Laden der Konfigurationsdatei {args.config}: {e}")
         sys.exit(1)
 
-    cacher = Cacher(YamlDatabase(args.db))
+    default_rate_limiter.requests_per_second = args.rate_limit
+
+    # Im Plan-Modus bleiben alle Änderungen am Sync-State (Cache, Tokens) im Speicher
+    if args.db_backend == "sqlite":
+        try:
+            db = SqliteDatabase(args.db, read_only=args.plan)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit(1)
+        if args.migrate_from and args.plan:
+            logging.warning("--migrate-from wird im Plan-Modus ignoriert")
+        elif args.migrate_from:
+            migrate_yaml_to_sqlite(YamlDatabase(args.migrate_from), db)
+    else:
+        db = YamlDatabase(args.db, write_behind=True, read_only=args.plan)
+    cacher = Cacher(db)
+    token_store = Token_Store(db, os.environ.get("SYNC_STATE_KEY"))
+    response_cache = None
+    if args.http_cache:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(args.db)), "http_cache")
+        response_cache = Http_Response_Cache(cache_dir, args.http_cache_ttl)
     event_matcher = Event_Matcher(os.environ.get("WORSHIPTOOLS_TZ"), os.environ.get("CHURCHTOOLS_TZ"), config)
-    ct_api = Churchtools_API(os.environ.get("CHURCHTOOLS_BASE_URL"), os.environ.get("CHURCHTOOLS_LOGIN_TOKEN"))
-    wt_api = Worshiptools_API(
-        os.environ.get("WORSHIPTOOLS_EMAIL"),
-        os.environ.get("WORSHIPTOOLS_PASSWORD"),
-        os.environ.get("WORSHIPTOOLS_ACCOUNT_ID"),
-    )
-    ct_songs = ct_api.get_all("songs", {"limit": 100})["data"]
-    wt_songs = wt_api.get_all("song", {"rows": 100})["docs"]
-    song_matcher = Song_Matcher(wt_songs, ct_songs)
-    song_manager = CT_Song_Manager(ct_api, config, song_matcher)
+    ct_api_class = Plan_Churchtools_API if args.plan else Churchtools_API
+    # Im Plan-Modus werden die Counter nicht im Sync-State gespeichert
+    metrics_exporter = Metrics_Exporter(None if args.plan else db)
+    if args.metrics_port is not None:
+        metrics_exporter.serve(args.metrics_port)
 
-    wt_services = wt_api.get("service")["docs"]
-    logging.info(f"Worship Tool Services: {len(wt_services)}")
-    ct_events = ct_api.get("events")["data"]
-    logging.debug(f"Churchtools Events: {len(ct_events)}")
-    events = event_matcher.match(wt_services, ct_events)
-    for event in events:
-        if cacher.is_already_synced(event):
-            continue
-        logging.info(
-            f"Syncing to: {event['ct']['name']} ({event['ct']['startDate']}) - using config: {event['config']['name']}"
-        )
+    def record_metrics(succeeded: bool):
+        summary = report_run_stats(args.stats_file)
+        metrics_exporter.record_run(summary, succeeded, cache_size=len(db.get_cache_entries()))
+        db.flush()
+        if args.metrics_file:
+            metrics_exporter.write_textfile(args.metrics_file)
+
+    # Connection-Pools passend zur Parallelität, damit keine Verbindungen verworfen und neu aufgebaut werden
+    max_workers = max(args.workers, Churchtools_API.max_workers)
+    try:
+        with default_instrumentation.phase("login"):
+            ct_api = ct_api_class(
+                os.environ.get("CHURCHTOOLS_BASE_URL"),
+                os.environ.get("CHURCHTOOLS_LOGIN_TOKEN"),
+                max_workers=max_workers,
+                token_store=token_store,
+                response_cache=response_cache,
+            )
+            wt_api = Worshiptools_API(
+                os.environ.get("WORSHIPTOOLS_EMAIL"),
+                os.environ.get("WORSHIPTOOLS_PASSWORD"),
+                os.environ.get("WORSHIPTOOLS_ACCOUNT_ID"),
+                max_workers=max_workers,
+                token_store=token_store,
+                response_cache=response_cache,
+                app_url=os.environ.get("WORSHIPTOOLS_APP_URL"),
+                login_url=os.environ.get("WORSHIPTOOLS_AUTH_URL"),
+                api_url=os.environ.get("WORSHIPTOOLS_API_URL"),
+            )
+    except Exception:
+        # Fehlgeschlagener Login zählt als fehlgeschlagener Durchlauf, damit er in den Metriken sichtbar ist
+        record_metrics(False)
+        raise
+    song_library = Song_Library_Cacher(db, timedelta(hours=args.song_cache_ttl))
+
+    def run():
+        succeeded = False
+        try:
+            sync_events(args, config, db, cacher, event_matcher, ct_api, wt_api, song_library)
+            succeeded = True
+        finally:
+            record_metrics(succeeded)
+
+    if not args.daemon or args.plan:
+        run()
+        return
+
+    # Sessions und Song-Kataloge bleiben zwischen den Durchläufen im Speicher, die Kataloge werden je Durchlauf geprüft
+    logging.info(f"Daemon gestartet, synchronisiere alle {args.interval} Sekunden")
+    while True:
+        started = time.monotonic()
         try:
-            event_manager = CT_Event_Manager(ct_api, config, event["ct"]["id"])
-            songs = song_manager.convert(event["wt"]["songs"])
+            run()
+        except Exception:
+            logging.critical("Unbehandelter Fehler im Sync-Durchlauf", exc_info=True)
+            send_telegram_message(log_stream.getvalue())
+        log_stream.seek(0)
+        log_stream.truncate()
+        time.sleep(max(0, args.interval - (time.monotonic() - started)))
+
+
+def sync_events(
+    args: argparse.Namespace,
+    config: Config,
+    db: Database,
+    cacher: Cacher,
+    event_matcher: Event_Matcher,
+    ct_api: Churchtools_API,
+    wt_api: Worshiptools_API,
+    song_library: Song_Library_Cacher,
+):
+    """Ein Sync-Durchlauf: Services und Events abfragen, abgleichen und alle noch nicht synchronisierten Events syncen."""
+    with default_instrumentation.phase("song_catalog_fetch"):
+        song_matcher = Song_Matcher(song_library.wt_songs(wt_api), song_library.ct_songs(ct_api))
+    # Nur der Zeitraum ab heute wird abgefragt, vergangene Events werden weder geladen noch geparst
+    start = datetime.now(event_matcher.ct_tzinfo).date()
+    end = start + timedelta(weeks=args.weeks)
+    with default_instrumentation.phase("event_fetch"):
+        wt_services = wt_api.get_services(start, end)
+        logging.info(f"Worship Tool Services: {len(wt_services)}")
+        ct_events = ct_api.get_events(start, end)
+        logging.debug(f"Churchtools Events: {len(ct_events)}")
+    with default_instrumentation.phase("matching"):
+        events = event_matcher.match(wt_services, ct_events)
+    with default_instrumentation.phase("cache_check"):
+        cacher.clean_cache()
+        pending_events = [event for event in events if not cacher.is_already_synced(event)]
+    unknown_wt_song_ids = {
+        wt_song_id
+        for event in pending_events
+        for wt_song_id in event["wt"]["songs"]
+        if not song_matcher.find_wt_song({"id": wt_song_id})
+    }
+    if unknown_wt_song_ids:
+        # Neue Worshiptools Songs seit dem letzten Laden des Katalogs: Katalog unabhängig von der TTL neu laden
+        logging.info(f"{len(unknown_wt_song_ids)} unbekannte Worshiptools Songs, lade den Song-Katalog neu")
+        with default_instrumentation.phase("song_catalog_fetch"):
+            song_matcher = Song_Matcher(song_library.wt_songs(wt_api, refresh=True), song_matcher.ct_songs)
+    song_manager = CT_Song_Manager(ct_api, config, song_matcher)
+    default_instrumentation.count("events_matched", len(events))
+    default_instrumentation.count("events_skipped_cached", len(events) - len(pending_events))
+    agenda_store = CT_Agenda_Store(ct_api, max_workers=ct_api.max_workers)
+    with default_instrumentation.phase("agenda_fetch"):
+        agenda_store.prefetch([event["ct"]["id"] for event in pending_events])
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(sync_event, ct_api, config, song_manager, cacher, agenda_store, event, args.plan)
+            for event in pending_events
+        ]
+        for future in futures:
+            future.result()
+    logging.info(
+        f"HTTP Verbindungen ChurchTools: {connection_stats(ct_api.session)}, "
+        f"Worshiptools: {connection_stats(wt_api.session)}"
+    )
+    if args.plan:
+        ct_api.log_plan()
+        return
+    if args.song_cache_ttl > 0:
+        song_library.save(song_manager.song_matcher)
+    db.flush()
+
+
+def sync_event(
+    ct_api: Churchtools_API,
+    config: Config,
+    song_manager: CT_Song_Manager,
+    cacher: Cacher,
+    agenda_store: CT_Agenda_Store,
+    event: Event_Config_Match,
+    plan: bool = False,
+):
+    logging.info(
+        f"Syncing to: {event['ct']['name']} ({event['ct']['startDate']}) - using config: {event['config']['name']}"
+    )
+    try:
+        event_manager = CT_Event_Manager(ct_api, config, event["ct"]["id"], agenda_store.get(event["ct"]["id"]))
+        songs = song_manager.convert(event["wt"]["songs"])
+        with default_instrumentation.phase("placement"):
             event_manager.place_songs(songs, event["config"]["song_placements"])
+        if len(songs) < len(event["wt"]["songs"]):
+            # Nicht in den Cache, damit das Event im nächsten Durchlauf mit den fehlenden Songs erneut synchronisiert wird
+            logging.warning(
+                f"{len(event['wt']['songs']) - len(songs)} Songs für {event['ct']['name']} ({event['ct']['startDate']}) "
+                "konnten nicht zugeordnet oder angelegt werden"
+            )
+        elif not plan:
             cacher.cache_sync(event)
-        except AgendaException as e:
-            logging.warning(f"Unable to sync to: {event['ct']['name']} - {event['ct']['startDate']}: {e}")
+    except AgendaException as e:
+        default_instrumentation.count("agenda_exceptions")
+        logging.warning(f"Unable to sync to: {event['ct']['name']} - {event['ct']['startDate']}: {e}")
+
+
+def report_run_stats(stats_file: str | None = None) -> dict:
+    """Loggt die JSON-Zusammenfassung des Durchlaufs, schreibt sie optional in stats_file und setzt die Messwerte zurück."""
+    summary = default_instrumentation.summary()
+    default_instrumentation.reset()
+    summary_json = json.dumps(summary)
+    logging.info(f"Sync Statistik: {summary_json}")
+    if stats_file:
+        with open(stats_file, "w", encoding="utf-8") as file:
+            file.write(summary_json + "\n")
+    return summary
 
 
 if __name__ == "__main__":
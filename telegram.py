@@ -1,10 +1,14 @@
 import logging
-import requests
 import os
 
+from http_client import create_session
+
 
 REQUEST_TIMEOUT = 30
 
+# Gemeinsame Session, damit mehrere Nachrichten die TLS-Verbindung wiederverwenden
+session = create_session(pool_size=1)
+
 
 def send_telegram_message(message: str):
     bot_token = os.environ.get("TELEGRAM_BOT_TOKEN")
@@ -20,6 +24,6 @@ def send_telegram_message(message: str):
         "text": message,
     }
     logging.debug(f"Nachricht per Telegram gesendet: {message}")
-    response = requests.post(url, data=payload, timeout=REQUEST_TIMEOUT)
+    response = session.post(url, data=payload, timeout=REQUEST_TIMEOUT)
     if response.status_code != 200:
         logging.error(f"Fehler beim Senden der Telegram-Nachricht: {response.text}")
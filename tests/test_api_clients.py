@@ -1,10 +1,21 @@
+import argparse
+import base64
+from datetime import date, datetime, timedelta, timezone
 import json
+import threading
 
 import pytest
 
+from benchmarks import synthetic
+from benchmarks.mock_server import Mock_Dataset, Mock_Server
 import churchtools_api
-import worshiptools_api
+import http_client
+import sync
+from cache import Cacher, Song_Library_Cacher, SqliteDatabase, YamlDatabase
 from churchtools_api import Churchtools_API, ChurchtoolsApiError
+from http_client import Http_Response_Cache, Retry_Policy
+from matcher import Event_Matcher, Song_Matcher
+from token_store import Token_Store
 from worshiptools_api import Worshiptools_API, WorshiptoolsApiError
 
 
@@ -12,7 +23,7 @@ class Response:
     def __init__(self, status_code=200, payload=None, text=""):
         self.status_code = status_code
         self._payload = payload or {}
-        self.text = text
+        self.text = text or json.dumps(self._payload)
         self.content = json.dumps(self._payload).encode("utf-8")
 
     def json(self):
@@ -27,6 +38,9 @@ class ChurchSession:
         self.post_calls = []
         self.put_calls = []
 
+    def mount(self, prefix, adapter):
+        pass
+
     def get(self, url, **kwargs):
         self.get_calls.append((url, kwargs))
         if url.endswith("/api/whoami"):
@@ -50,7 +64,7 @@ def test_churchtools_constructor_raises_without_auth():
 
 
 def test_churchtools_constructor_raises_on_failed_login(monkeypatch):
-    monkeypatch.setattr(churchtools_api.requests, "Session", lambda: ChurchSession(login_status=401))
+    monkeypatch.setattr(http_client.requests, "Session", lambda: ChurchSession(login_status=401))
 
     with pytest.raises(ChurchtoolsApiError):
         Churchtools_API("https://example.church.tools", "bad")
@@ -111,12 +125,30 @@ def test_churchtools_update_agenda_item_uses_after_id():
     assert json.loads(kwargs["data"]) == {"type": "song"}
 
 
+def test_churchtools_agenda_write_invalidates_cached_agenda(tmp_path):
+    api = object.__new__(Churchtools_API)
+    api.base_url = "https://example.church.tools"
+    api.session = ChurchSession()
+    api.response_cache = Http_Response_Cache(str(tmp_path), ttl=60)
+
+    api.get("events/99/agenda")
+    api.get("events/99/agenda")
+    assert len(api.session.get_calls) == 1
+
+    api.create_agenda_item(99, {"type": "song"})
+    api.get("events/99/agenda")
+    assert len(api.session.get_calls) == 2
+
+
 class WorshipSession:
     def __init__(self, token="token"):
         self.headers = {}
         self.cookies = {"weAuthToken": token}
         self.get_calls = []
 
+    def mount(self, prefix, adapter):
+        pass
+
     def get(self, url, **kwargs):
         self.get_calls.append((url, kwargs))
         return Response(200, {"response": {"numFound": 0, "docs": []}})
@@ -126,7 +158,7 @@ class WorshipSession:
 
 
 def test_worshiptools_login_requires_bearer_token(monkeypatch):
-    monkeypatch.setattr(worshiptools_api.requests, "Session", lambda: WorshipSession(token=None))
+    monkeypatch.setattr(http_client.requests, "Session", lambda: WorshipSession(token=None))
 
     with pytest.raises(WorshiptoolsApiError):
         Worshiptools_API("email", "password", "account")
@@ -146,3 +178,318 @@ def test_worshiptools_get_all_paginates_by_start():
 
     assert api.get_all("song", {"rows": 1}) == {"docs": [{"id": "1"}, {"id": "2"}]}
     assert calls == [{"rows": 1, "start": 0}, {"rows": 1, "start": 1}]
+
+
+def test_churchtools_get_all_fetches_remaining_pages_in_order():
+    api = object.__new__(Churchtools_API)
+    api.max_workers = 3
+    calls = []
+
+    def get(endpoint, params=None):
+        calls.append(params["page"])
+        return {"data": [params["page"] * 10, params["page"] * 10 + 1], "meta": {"pagination": {"lastPage": 4}}}
+
+    api.get = get
+
+    assert api.get_all("songs", {"limit": 2}) == {"data": [10, 11, 20, 21, 30, 31, 40, 41]}
+    assert sorted(calls) == [1, 2, 3, 4]
+
+
+def test_event_and_service_requests_are_limited_to_the_sync_window():
+    ct_api = object.__new__(Churchtools_API)
+    ct_api.max_workers = 2
+    ct_calls = []
+
+    def ct_get(endpoint, params=None):
+        ct_calls.append((endpoint, params))
+        return {"data": [{"id": params["page"]}], "meta": {"pagination": {"lastPage": 2}}}
+
+    ct_api.get = ct_get
+    wt_api = object.__new__(Worshiptools_API)
+    wt_calls = []
+
+    def wt_get(endpoint, params=None):
+        wt_calls.append((endpoint, params))
+        return {"numFound": 1, "docs": [{"id": "s", "times": ["2024-02-04T10:00"]}]}
+
+    wt_api.get = wt_get
+
+    assert ct_api.get_events(date(2024, 1, 1), date(2024, 3, 25)) == [{"id": 1}, {"id": 2}]
+    assert wt_api.get_services(date(2024, 1, 1), date(2024, 3, 25)) == [{"id": "s", "times": ["2024-02-04T10:00"]}]
+    assert sorted(ct_calls, key=lambda call: call[1]["page"]) == [
+        ("events", {"from": "2024-01-01", "to": "2024-03-25", "page": 1}),
+        ("events", {"from": "2024-01-01", "to": "2024-03-25", "page": 2}),
+    ]
+    assert wt_calls == [("service", {"startDate": "2024-01-01", "endDate": "2024-03-25", "rows": 50, "start": 0})]
+
+
+def test_churchtools_events_without_pagination_use_the_single_response():
+    api = object.__new__(Churchtools_API)
+    calls = []
+
+    def get(endpoint, params=None):
+        calls.append(params)
+        return {"data": [{"id": 1}, {"id": 2}]}
+
+    api.get = get
+
+    assert api.get_events(date(2024, 1, 1), date(2024, 3, 25)) == [{"id": 1}, {"id": 2}]
+    assert calls == [{"from": "2024-01-01", "to": "2024-03-25", "page": 1}]
+
+
+def test_worshiptools_services_are_filtered_locally_when_date_params_are_ignored():
+    api = object.__new__(Worshiptools_API)
+    api.service_page_size = 2
+    # Absteigend sortierte Historie, die Datumsparameter werden vom Server ignoriert
+    days = [date(2024, 4, 1) - timedelta(days=7 * i) for i in range(200)]
+    history = [{"id": str(i), "times": [f"{day.isoformat()}T10:00"]} for i, day in enumerate(days)]
+    starts = []
+
+    def get(endpoint, params=None):
+        starts.append(params["start"])
+        return {"numFound": len(history), "docs": history[params["start"] : params["start"] + params["rows"]]}
+
+    api.get = get
+
+    services = api.get_services(date(2024, 3, 1), date(2024, 3, 31))
+
+    assert [service["times"][0][:10] for service in services] == ["2024-03-25", "2024-03-18", "2024-03-11", "2024-03-04"]
+    assert max(starts) < 12
+
+
+def test_worshiptools_get_all_rerequests_range_when_num_found_changes():
+    api = object.__new__(Worshiptools_API)
+    totals = iter([3, 4, 4, 4, 4])
+
+    def get(endpoint, params=None):
+        start = params["start"]
+        total = next(totals)
+        return {"numFound": total, "docs": [{"id": str(i)} for i in range(start, min(start + 2, total))]}
+
+    api.get = get
+
+    assert api.get_all("song", {"rows": 2}) == {"docs": [{"id": "0"}, {"id": "1"}, {"id": "2"}, {"id": "3"}]}
+
+
+def test_churchtools_iter_all_streams_pages_into_song_matcher():
+    api = object.__new__(Churchtools_API)
+
+    def get(endpoint, params=None):
+        page = params["page"]
+        song = {"id": page, "name": f"Song {page}", "author": "A", "ccli": str(page), "arrangements": [], "category": {}}
+        return {"data": [song], "meta": {"pagination": {"lastPage": 3}}}
+
+    api.get = get
+    stream = api.iter_all("songs", {"limit": 1})
+
+    assert next(stream)["id"] == 1
+
+    matcher = Song_Matcher([{"id": "w3", "name": "Song 3", "artist": "A", "ccli": "3", "key": "G"}], stream)
+
+    assert [song["id"] for song in matcher.ct_songs] == [2, 3]
+    assert matcher.match("w3")["id"] == 3
+
+
+def test_plan_churchtools_api_records_writes_without_sending(monkeypatch):
+    monkeypatch.setattr(http_client.requests, "Session", lambda: ChurchSession())
+    monkeypatch.setattr(churchtools_api, "send_telegram_message", lambda message: pytest.fail("telegram in plan mode"))
+    api = churchtools_api.Plan_Churchtools_API("https://example.church.tools", "token")
+
+    song = api.create_song("Song", 4, author="A", ccli="123")
+    item = api.create_agenda_item(99, {"type": "song", "arrangementId": song["arrangements"][0]["id"]}, after_id=13)
+    api.update_agenda_item(99, 12, {"type": "song"})
+
+    assert song["id"] < 0 and item["data"]["id"] < 0
+    assert [call["call"] for call in api.planned_calls] == ["create_song", "create_agenda_item", "update_agenda_item"]
+    assert api.session.post_calls == [] and api.session.put_calls == []
+
+
+def test_churchtools_relogins_once_on_401(monkeypatch):
+    sessions = []
+
+    class ExpiringSession(ChurchSession):
+        def get(self, url, **kwargs):
+            if "/api/events" in url and len(sessions) == 1:
+                self.get_calls.append((url, kwargs))
+                return Response(401, {})
+            return super().get(url, **kwargs)
+
+    def new_session():
+        sessions.append(ExpiringSession())
+        return sessions[-1]
+
+    monkeypatch.setattr(http_client.requests, "Session", new_session)
+    api = Churchtools_API("https://example.church.tools", "token")
+
+    assert api.get("events") == {"data": [], "meta": {"pagination": {"lastPage": 1}}}
+    assert len(sessions) == 2
+    assert api.session is sessions[1]
+
+
+def test_worshiptools_relogins_once_on_401(monkeypatch):
+    tokens = iter(["old", "new"])
+
+    class ExpiringSession(WorshipSession):
+        def post(self, url, **kwargs):
+            self.cookies["weAuthToken"] = next(tokens)
+            return Response(200, {})
+
+        def get(self, url, **kwargs):
+            self.get_calls.append((url, kwargs))
+            if "api.worship.tools" in url and kwargs["headers"]["Authorization"] == "Bearer old":
+                return Response(401, {})
+            return Response(200, {"response": {"numFound": 0, "docs": []}})
+
+    monkeypatch.setattr(http_client.requests, "Session", lambda: ExpiringSession())
+    api = Worshiptools_API("email", "password", "account")
+
+    assert api.get("service") == {"numFound": 0, "docs": []}
+    assert api.bearer_token == "new"
+
+
+def test_worshiptools_reuses_stored_token_and_saves_new_login(monkeypatch, tmp_path):
+    logins = []
+
+    class Session(WorshipSession):
+        def post(self, url, **kwargs):
+            logins.append(url)
+            return Response(200, {})
+
+    monkeypatch.setattr(http_client.requests, "Session", lambda: Session(token="fresh"))
+    token_store = Token_Store(YamlDatabase(str(tmp_path / "db.yaml")))
+
+    Worshiptools_API("email", "password", "account", token_store=token_store)
+    api = Worshiptools_API("email", "password", "account", token_store=token_store)
+
+    assert len(logins) == 1
+    assert api.bearer_token == "fresh"
+
+
+def test_churchtools_refetches_stored_csrf_token_rejected_by_new_session(monkeypatch, tmp_path):
+    class Session(ChurchSession):
+        def post(self, url, **kwargs):
+            self.post_calls.append((url, dict(self.headers)))
+            if self.headers.get("CSRF-Token") != "csrf":
+                return Response(403, {})
+            return Response(200, {"data": {"id": 1}})
+
+    session = Session()
+    monkeypatch.setattr(http_client.requests, "Session", lambda: session)
+    token_store = Token_Store(YamlDatabase(str(tmp_path / "db.yaml")))
+    token_store.save("churchtools_csrf:https://example.church.tools", "stale")
+    api = Churchtools_API("https://example.church.tools", "token", token_store=token_store)
+
+    assert api.post("songs", {"name": "Song"}) == {"data": {"id": 1}}
+    assert [headers["CSRF-Token"] for _, headers in session.post_calls] == ["stale", "csrf"]
+    assert token_store.get("churchtools_csrf:https://example.church.tools") == "csrf"
+
+
+def test_token_store_makes_state_file_owner_only_for_plaintext_tokens(tmp_path):
+    yaml_path = tmp_path / "db.yaml"
+    yaml_db = YamlDatabase(str(yaml_path), write_behind=True)
+    yaml_db.insert("cache", [])
+    yaml_db.flush()
+    yaml_path.chmod(0o644)
+    sqlite_path = tmp_path / "db.sqlite"
+    sqlite_db = SqliteDatabase(str(sqlite_path))
+    sqlite_path.chmod(0o644)
+
+    for db in (yaml_db, sqlite_db):
+        Token_Store(db).save("worshiptools:email", "token")
+        db.flush()
+
+    assert yaml_path.stat().st_mode & 0o777 == 0o600
+    assert sqlite_path.stat().st_mode & 0o777 == 0o600
+    assert YamlDatabase(str(yaml_path)).get("auth_tokens")["worshiptools:email"]["token"] == "token"
+
+
+def test_token_store_reads_jwt_expiry_and_drops_expired_tokens(tmp_path):
+    token_store = Token_Store(YamlDatabase(str(tmp_path / "db.yaml")))
+    expired = datetime.now(timezone.utc) - timedelta(minutes=1)
+    claims = base64.urlsafe_b64encode(json.dumps({"exp": int(expired.timestamp())}).encode()).decode().rstrip("=")
+
+    token_store.save("jwt", f"header.{claims}.signature")
+    token_store.save("plain", "token")
+
+    assert token_store.get("jwt") is None
+    assert token_store.get("plain") == "token"
+
+
+def test_full_sync_against_mock_server_survives_errors_and_rate_limits(tmp_path):
+    dataset = Mock_Dataset(songs=300, events=20, agenda_items=12)
+    server = Mock_Server(("127.0.0.1", 0), dataset, error_rate=0.05, rate_limit_rate=0.05, retry_after=0, seed=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    retry_policy = Retry_Policy(backoff=0)
+    try:
+        db = YamlDatabase(str(tmp_path / "db.yaml"))
+        ct_api = Churchtools_API(base_url, "token")
+        ct_api.retry_policy = retry_policy
+        wt_api = Worshiptools_API(
+            "a@example.test",
+            "password",
+            "account",
+            app_url=f"{base_url}/wt/app",
+            login_url=f"{base_url}/wt/login",
+            api_url=f"{base_url}/wt/v1",
+        )
+        wt_api.retry_policy = retry_policy
+        song_library = Song_Library_Cacher(db, timedelta(hours=24))
+        event_matcher = Event_Matcher(synthetic.TZ, synthetic.TZ, synthetic.CONFIG)
+        args = argparse.Namespace(weeks=12, workers=2, plan=False, song_cache_ttl=24, stats_file=None)
+
+        sync.sync_events(
+            args,
+            synthetic.CONFIG,
+            db,
+            Cacher(db),
+            event_matcher,
+            ct_api,
+            wt_api,
+            song_library,
+        )
+
+        assert dataset.agendas
+        assert all(
+            any(item.get("arrangementId") for item in agenda["items"]) for agenda in dataset.agendas.values()
+        )
+        assert len(db.get_cache_entries()) == len(dataset.agendas)
+    finally:
+        server.shutdown()
+
+
+def test_sync_reloads_worshiptools_catalog_for_unknown_songs_and_skips_cache_when_unresolved(tmp_path):
+    dataset = Mock_Dataset(songs=50, events=7, agenda_items=12)
+    server = Mock_Server(("127.0.0.1", 0), dataset)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        db = YamlDatabase(str(tmp_path / "db.yaml"))
+        ct_api = Churchtools_API(base_url, "token")
+        ct_api.notify = False
+        wt_api = Worshiptools_API(
+            "a@example.test",
+            "password",
+            "account",
+            app_url=f"{base_url}/wt/app",
+            login_url=f"{base_url}/wt/login",
+            api_url=f"{base_url}/wt/v1",
+        )
+        song_library = Song_Library_Cacher(db, timedelta(hours=24))
+        event_matcher = Event_Matcher(synthetic.TZ, synthetic.TZ, synthetic.CONFIG)
+        args = argparse.Namespace(weeks=12, workers=1, plan=False, song_cache_ttl=24, stats_file=None)
+        cacher = Cacher(db)
+        sync.sync_events(args, synthetic.CONFIG, db, cacher, event_matcher, ct_api, wt_api, song_library)
+        assert len(db.get_cache_entries()) == 2
+
+        # Neuer WT Song nach dem ersten Durchlauf (Anzahl bleibt durch das Entfernen eines alten gleich)
+        new_song = {"id": "wt-new", "name": "Neu", "artist": "X", "ccli": None, "key": "G"}
+        dataset.wt_songs[0] = new_song
+        dataset.wt_services[0]["songs"] = ["wt-new"]
+        dataset.wt_services[6]["songs"] = ["wt-missing"]
+        sync.sync_events(args, synthetic.CONFIG, db, cacher, event_matcher, ct_api, wt_api, song_library)
+
+        assert any(song["name"] == "Neu" for song in dataset.ct_songs)
+        assert len(db.get_cache_entries()) == 3
+    finally:
+        server.shutdown()
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+import async_api
+from async_api import Async_Churchtools_API, Async_Worshiptools_API
+from cache import YamlDatabase
+from instrumentation import default_instrumentation
+from token_store import Token_Store
+
+# aiohttp ist optional, ohne das Paket werden diese Tests übersprungen
+web = pytest.importorskip("aiohttp.web")
+TestServer = pytest.importorskip("aiohttp.test_utils").TestServer
+
+
+def churchtools_app(state):
+    async def whoami(request):
+        return web.json_response({"data": {"id": 1, "email": "a@example.test"}})
+
+    async def csrftoken(request):
+        return web.json_response({"data": "csrf"})
+
+    async def songs(request):
+        state["in_flight"] = state["in_flight"] + 1
+        state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        await asyncio.sleep(0.01)
+        state["in_flight"] = state["in_flight"] - 1
+        page = int(request.query["page"])
+        return web.json_response({"data": [{"id": page}], "meta": {"pagination": {"lastPage": 6}}})
+
+    async def agenda_items(request):
+        state["posts"].append((dict(request.query), await request.json(), request.headers.get("CSRF-Token")))
+        if request.headers.get("CSRF-Token") != "csrf":
+            return web.json_response({}, status=403)
+        return web.json_response({"data": {"id": 100}}, status=201)
+
+    app = web.Application()
+    app.router.add_get("/api/whoami", whoami)
+    app.router.add_get("/api/csrftoken", csrftoken)
+    app.router.add_get("/api/songs", songs)
+    app.router.add_post("/api/events/{event_id}/agenda/items", agenda_items)
+    return app
+
+
+def test_async_churchtools_get_all_and_writes_with_bounded_concurrency():
+    state = {"in_flight": 0, "max_in_flight": 0, "posts": []}
+
+    async def run():
+        async with TestServer(churchtools_app(state)) as server:
+            base_url = str(server.make_url("")).rstrip("/")
+            async with Async_Churchtools_API(base_url, "token", max_concurrency=2) as ct_api:
+                songs = await ct_api.get_all("songs", {"limit": 1})
+                item = await ct_api.create_agenda_item(99, {"type": "song"}, before_id=13)
+        return songs, item
+
+    songs, item = asyncio.run(run())
+
+    assert [song["id"] for song in songs["data"]] == [1, 2, 3, 4, 5, 6]
+    assert state["max_in_flight"] == 2
+    assert item == {"data": {"id": 100}}
+    assert state["posts"] == [({"before_id": "13"}, {"type": "song"}, "csrf")]
+
+
+def test_async_churchtools_refetches_stored_csrf_token_and_records_requests(tmp_path):
+    state = {"in_flight": 0, "max_in_flight": 0, "posts": []}
+    token_store = Token_Store(YamlDatabase(str(tmp_path / "db.yaml")))
+    default_instrumentation.reset()
+
+    async def run():
+        async with TestServer(churchtools_app(state)) as server:
+            base_url = str(server.make_url("")).rstrip("/")
+            token_store.save(f"churchtools_csrf:{base_url}", "stale")
+            async with Async_Churchtools_API(base_url, "token", token_store=token_store) as ct_api:
+                return base_url, await ct_api.create_agenda_item(99, {"type": "song"})
+
+    base_url, item = asyncio.run(run())
+
+    assert item == {"data": {"id": 100}}
+    assert [csrf_token for _, _, csrf_token in state["posts"]] == ["stale", "csrf"]
+    assert token_store.get(f"churchtools_csrf:{base_url}") == "csrf"
+    endpoints = {(http["method"], http["endpoint"]) for http in default_instrumentation.summary()["http"]}
+    assert ("POST", "/api/events/{id}/agenda/items") in endpoints
+
+
+def test_async_clients_require_aiohttp(monkeypatch):
+    monkeypatch.setattr(async_api, "aiohttp", None)
+
+    with pytest.raises(RuntimeError, match="aiohttp"):
+        Async_Churchtools_API("https://example.church.tools", "token")
+
+
+def test_async_worshiptools_login_and_pagination():
+    async def app_page(request):
+        return web.Response(text="app")
+
+    async def login(request):
+        response = web.Response(text="ok")
+        response.set_cookie("weAuthToken", "token")
+        return response
+
+    async def song(request):
+        assert request.headers["Authorization"] == "Bearer token"
+        assert request.headers["Origin"] == str(request.url.origin())
+        start = int(request.query["start"])
+        return web.json_response({"response": {"numFound": 3, "docs": [{"id": str(start)}]}})
+
+    app = web.Application()
+    app.router.add_get("/app", app_page)
+    app.router.add_post("/login", login)
+    app.router.add_get("/v1/account/acc/song", song)
+
+    async def run():
+        async with TestServer(app) as server:
+            wt_api = Async_Worshiptools_API(
+                "email",
+                "password",
+                "acc",
+                app_url=str(server.make_url("/app")),
+                login_url=str(server.make_url("/login")),
+                api_url=str(server.make_url("/v1")),
+            )
+            async with wt_api:
+                return await wt_api.get_all("song", {"rows": 1})
+
+    assert asyncio.run(run()) == {"docs": [{"id": "0"}, {"id": "1"}, {"id": "2"}]}
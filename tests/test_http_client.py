@@ -0,0 +1,180 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+import requests
+
+from instrumentation import default_instrumentation
+from http_client import Http_Response_Cache, Rate_Limiter, Retry_Policy, connection_stats, create_session
+
+
+class Response:
+    def __init__(self, status_code, headers=None, text=""):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = text
+
+
+def policy(sleeps):
+    retry_policy = Retry_Policy(max_retries=3, backoff=1)
+    retry_policy.sleep = sleeps.append
+    return retry_policy
+
+
+def test_retry_honors_retry_after_and_blocks_host():
+    sleeps = []
+    responses = iter([Response(429, {"Retry-After": "2"}), Response(200)])
+    rate_limiter = Rate_Limiter()
+    rate_limiter.sleep = sleeps.append
+
+    response = policy(sleeps).send("get", "https://a.test/api/songs", lambda: next(responses), rate_limiter)
+
+    assert response.status_code == 200
+    assert sleeps[0] == 2
+    assert 0 < sleeps[1] <= 2
+
+
+def test_retry_uses_bounded_exponential_backoff_for_server_errors():
+    sleeps = []
+    responses = iter([Response(502), Response(503), Response(504), Response(502)])
+
+    response = policy(sleeps).send("get", "https://a.test/api/songs", lambda: next(responses))
+
+    assert response.status_code == 502
+    assert len(sleeps) == 3
+    assert all(0 <= delay <= 2**attempt for attempt, delay in enumerate(sleeps))
+
+
+def test_non_idempotent_requests_are_not_retried():
+    sleeps = []
+    calls = []
+
+    def send():
+        calls.append(1)
+        return Response(503)
+
+    assert policy(sleeps).send("post", "https://a.test/api/songs", send).status_code == 503
+    assert calls == [1]
+    assert sleeps == []
+
+
+def test_rate_limited_post_is_retried_and_blocks_host():
+    sleeps = []
+    responses = iter([Response(429, {"Retry-After": "45"}), Response(503, {"Retry-After": "1"}), Response(201)])
+    rate_limiter = Rate_Limiter()
+    blocked = []
+    rate_limiter.block = lambda host, seconds: blocked.append((host, seconds))
+
+    response = policy(sleeps).send("post", "https://a.test/api/songs", lambda: next(responses), rate_limiter)
+
+    assert response.status_code == 201
+    assert sleeps == [45, 1]
+    assert blocked == [("a.test", 45)]
+
+
+def test_retry_after_above_ceiling_aborts_instead_of_retrying_early():
+    sleeps = []
+    retry_policy = policy(sleeps)
+    retry_policy.max_retry_after = 60
+
+    response = retry_policy.send("get", "https://a.test/api/songs", lambda: Response(429, {"Retry-After": "3600"}))
+
+    assert response.status_code == 429
+    assert sleeps == []
+
+
+def test_connection_errors_are_retried_then_raised():
+    sleeps = []
+
+    def send():
+        raise requests.ConnectionError("down")
+
+    with pytest.raises(requests.ConnectionError):
+        policy(sleeps).send("get", "https://a.test/api/songs", send)
+
+    assert len(sleeps) == 3
+
+
+def test_rate_limiter_spaces_requests_per_host():
+    sleeps = []
+    rate_limiter = Rate_Limiter(requests_per_second=10)
+    rate_limiter.sleep = sleeps.append
+
+    rate_limiter.acquire("a.test")
+    rate_limiter.acquire("a.test")
+    rate_limiter.acquire("b.test")
+
+    assert len(sleeps) == 1
+    assert 0 < sleeps[0] <= 0.1
+
+
+def test_session_counts_opened_and_reused_connections():
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    default_instrumentation.reset()
+    try:
+        session = create_session(pool_size=2)
+        for _ in range(3):
+            session.get(f"http://127.0.0.1:{server.server_port}/", timeout=5)
+
+        assert connection_stats(session) == {"opened": 1, "reused": 2}
+        [http_stats] = default_instrumentation.summary()["http"]
+        assert http_stats["count"] == 3
+        assert http_stats["bytes_received"] == 6
+        assert sum(http_stats["latency_buckets"].values()) == 3
+    finally:
+        server.shutdown()
+
+
+def test_response_cache_sends_validators_and_serves_304_from_disk(tmp_path):
+    url = "https://a.test/api/events?from=2024-01-01"
+    sent_headers = []
+    responses = iter([Response(200, {"ETag": '"v1"'}, '{"data": [1]}'), Response(304)])
+
+    def send(headers):
+        sent_headers.append(headers)
+        return next(responses)
+
+    first = Http_Response_Cache(str(tmp_path)).fetch(url, send)
+    second = Http_Response_Cache(str(tmp_path)).fetch(url, send)
+
+    assert first.text == '{"data": [1]}'
+    assert sent_headers == [{}, {"If-None-Match": '"v1"'}]
+    assert second.status_code == 200
+    assert second.json() == {"data": [1]}
+
+
+def test_response_cache_uses_ttl_without_validators_and_invalidates_by_path(tmp_path):
+    url = "https://a.test/api/events/1/agenda"
+    calls = []
+
+    def send(headers):
+        calls.append(headers)
+        return Response(200, text='{"data": {}}')
+
+    assert Http_Response_Cache(str(tmp_path)).fetch(url, send).status_code == 200
+    assert Http_Response_Cache(str(tmp_path)).lookup(url) is None
+
+    response_cache = Http_Response_Cache(str(tmp_path), ttl=60)
+    response_cache.fetch(url, send)
+    response_cache.fetch(url, send)
+    assert len(calls) == 2
+
+    response_cache.fetch("https://a.test/api/events/2/agenda?x=1", send)
+    response_cache.invalidate("https://a.test/api/events/1/agenda")
+    response_cache.fetch(url, send)
+    assert len(calls) == 4
+    assert response_cache.lookup("https://a.test/api/events/2/agenda?x=1") is not None
+    response_cache.invalidate("https://a.test/api/songs")
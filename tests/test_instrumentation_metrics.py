@@ -0,0 +1,108 @@
+import json
+
+import requests
+
+from cache import YamlDatabase
+from instrumentation import Instrumentation, endpoint_name
+from metrics import Metrics_Exporter
+
+
+def test_instrumentation_summarizes_phases_and_endpoints():
+    instrumentation = Instrumentation()
+    with instrumentation.phase("matching"):
+        pass
+    instrumentation.record_phase("placement", 0.5)
+    instrumentation.record_phase("placement", 0.25)
+    instrumentation.record_http("get", "https://ct.test/api/events/12/agenda?x=1", 200, 0.2, 0, 100)
+    instrumentation.record_http("GET", "https://ct.test/api/events/13/agenda", 404, 3, 0, 10)
+
+    summary = instrumentation.summary()
+
+    assert summary["phases"]["placement"] == {"seconds": 0.75, "calls": 2}
+    assert summary["phases"]["matching"]["calls"] == 1
+    [agenda] = summary["http"]
+    assert agenda["endpoint"] == "/api/events/{id}/agenda"
+    assert agenda["bytes_received"] == 110
+    assert agenda["latency_buckets"]["0.25"] == 1
+    assert agenda["latency_buckets"]["5"] == 1
+    assert summary["status_codes"] == {"ct.test": {"200": 1, "404": 1}}
+    assert endpoint_name("https://api.worship.tools/v1/account/5f3a9b2c1d/service") == "/v1/account/{id}/service"
+
+
+def test_telegram_bot_token_never_reaches_summary_or_metrics():
+    token = "123456789:AAHsecret-token_value"
+    instrumentation = Instrumentation()
+    instrumentation.record_http("POST", f"https://api.telegram.org/bot{token}/sendMessage", 200, 0.1)
+    exporter = Metrics_Exporter()
+
+    summary = instrumentation.summary()
+    exporter.record_run(summary, succeeded=True, cache_size=0)
+
+    assert summary["http"][0]["endpoint"] == "/bot{token}/sendMessage"
+    assert token not in json.dumps(summary)
+    assert token not in exporter.render()
+    assert "123456789" not in exporter.render()
+
+
+def test_metrics_exporter_normalizes_endpoints_of_older_state(tmp_path):
+    db = YamlDatabase(str(tmp_path / "db.yaml"))
+    latency = {"host": "api.telegram.org", "method": "POST", "count": 1, "seconds": 0.1, "buckets": [1] + [0] * 8}
+    db.insert("metrics", {"http_latency": [{**latency, "endpoint": "/bot1:AAHsecret/sendMessage"}]})
+
+    text = Metrics_Exporter(db).render()
+
+    assert "AAHsecret" not in text
+    assert 'endpoint="/bot{token}/sendMessage"' in text
+
+
+def test_metrics_exporter_accumulates_runs_into_prometheus_text(tmp_path):
+    instrumentation = Instrumentation()
+    instrumentation.count("events_matched", 3)
+    instrumentation.count("events_skipped_cached", 2)
+    instrumentation.record_phase("placement", 0.5)
+    instrumentation.record_http("GET", "https://ct.test/api/songs?page=1", 200, 0.2)
+    exporter = Metrics_Exporter()
+
+    exporter.record_run(instrumentation.summary(), succeeded=True, cache_size=7)
+    exporter.record_run(instrumentation.summary(), succeeded=False, cache_size=8)
+    exporter.write_textfile(str(tmp_path / "sync.prom"))
+    text = (tmp_path / "sync.prom").read_text(encoding="utf-8")
+
+    assert "# TYPE wt_ct_sync_events_matched_total counter" in text
+    assert "wt_ct_sync_events_matched_total 6" in text
+    assert "wt_ct_sync_events_skipped_cached_total 4" in text
+    assert 'wt_ct_sync_runs_total{result="error"} 1' in text
+    assert 'wt_ct_sync_http_responses_total{host="ct.test",code="200"} 2' in text
+    assert 'wt_ct_sync_http_request_duration_seconds_bucket{host="ct.test",method="GET",endpoint="/api/songs",le="0.1"} 0' in text
+    assert 'wt_ct_sync_http_request_duration_seconds_bucket{host="ct.test",method="GET",endpoint="/api/songs",le="+Inf"} 2' in text
+    assert 'wt_ct_sync_phase_duration_seconds{phase="placement"} 0.5' in text
+    assert "wt_ct_sync_cache_entries 8" in text
+
+    server = exporter.serve(0, "127.0.0.1")
+    try:
+        response = requests.get(f"http://127.0.0.1:{server.server_port}/metrics", timeout=5)
+        assert response.text == text
+        assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    finally:
+        server.shutdown()
+
+
+def test_metrics_exporter_keeps_counters_across_runs_in_the_state_db(tmp_path):
+    instrumentation = Instrumentation()
+    instrumentation.count("events_matched", 3)
+    instrumentation.record_http("GET", "https://ct.test/api/songs?page=1", 200, 0.2)
+    db = YamlDatabase(str(tmp_path / "db.yaml"))
+
+    Metrics_Exporter(db).record_run(instrumentation.summary(), succeeded=False, cache_size=1)
+    text = Metrics_Exporter(db).render()
+    assert "\nwt_ct_sync_last_success_timestamp_seconds " not in text
+
+    exporter = Metrics_Exporter(db)
+    exporter.record_run(instrumentation.summary(), succeeded=True, cache_size=1)
+    text = Metrics_Exporter(db).render()
+    assert "wt_ct_sync_events_matched_total 6" in text
+    assert 'wt_ct_sync_runs_total{result="error"} 1' in text
+    assert 'wt_ct_sync_runs_total{result="success"} 1' in text
+    assert 'wt_ct_sync_http_responses_total{host="ct.test",code="200"} 2' in text
+    assert 'wt_ct_sync_http_request_duration_seconds_count{host="ct.test",method="GET",endpoint="/api/songs"} 2' in text
+    assert f"wt_ct_sync_last_success_timestamp_seconds {exporter.last_success}" in text
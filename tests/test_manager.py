@@ -1,6 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
 import pytest
 
-from manager import AgendaException, CT_Event_Manager, CT_Song_Manager
+from manager import AgendaException, CT_Agenda_Store, CT_Event_Manager, CT_Song_Manager
+from matcher import Song_Matcher
 
 
 class FakeAgendaApi:
@@ -146,3 +150,67 @@ def test_song_manager_does_not_cache_failed_song_creation():
 
     assert song_manager.create_ct_song({"name": "Song", "artist": "Artist", "ccli": None}) is None
     assert matcher.added == []
+
+
+def test_resync_with_one_changed_song_plans_single_update():
+    api = FakeAgendaApi()
+    api.agenda["items"].insert(
+        2, {"id": 14, "position": 2, "sortkey": 2, "title": "Second", "type": "song", "song": {"songId": 8}}
+    )
+    api.agenda["items"][3]["position"] = 3
+    event_manager = manager(api)
+    placements = [{"agenda_item": {"title": "Start"}, "position": "after", "songs": "[:]"}]
+
+    planned_items, operations = event_manager.plan_songs([ct_song(song_id=7), ct_song(song_id=9)], placements)
+
+    assert [operation["type"] for operation in operations] == ["keep", "update"]
+    assert api.created_items == [] and api.updated_items == []
+
+    event_manager.apply_operations(planned_items, operations)
+
+    assert [call["item_id"] for call in api.updated_items] == [14]
+    assert api.created_items == []
+    assert [item.get("song", {}).get("songId") for item in event_manager.ct_agenda["items"]] == [None, 7, 9, None]
+    assert [item["position"] for item in event_manager.ct_agenda["items"]] == [0, 1, 2, 3]
+
+
+def test_song_manager_creates_missing_song_once_across_threads():
+    class Api:
+        created = []
+
+        def create_song(self, **kwargs):
+            time.sleep(0.01)
+            self.created.append(kwargs["name"])
+            return {"id": len(self.created), "name": kwargs["name"], "author": "A", "ccli": "1", "arrangements": [{"id": 1}]}
+
+    api = Api()
+    matcher = Song_Matcher([{"id": "w1", "name": "Song", "artist": "A", "ccli": "1", "key": "G"}], [])
+    song_manager = CT_Song_Manager(api, {"ct_song_defaults": {"songcategory_id": 1}}, matcher)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: song_manager.convert(["w1"]), range(4)))
+
+    assert api.created == ["Song"]
+    assert [songs[0]["id"] for songs in results] == [1, 1, 1, 1]
+
+
+def test_agenda_store_prefetches_agendas_for_event_managers():
+    class Api(FakeAgendaApi):
+        calls = []
+
+        def get(self, endpoint):
+            self.calls.append(endpoint)
+            if endpoint == "events/98/agenda":
+                return None
+            return super().get(endpoint)
+
+    api = Api()
+    store = CT_Agenda_Store(api)
+
+    store.prefetch([99, 98, 99])
+    event_manager = CT_Event_Manager(api, {"ct_item_defaults": {}}, 99, store.get(99))
+
+    assert sorted(api.calls) == ["events/98/agenda", "events/99/agenda"]
+    assert event_manager.ct_agenda["id"] == 1
+    assert store.get(98) is None
+    assert set(store.fetch_seconds) == {98, 99}
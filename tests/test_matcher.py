@@ -67,3 +67,59 @@ def test_song_matcher_uses_ccli_before_name_author():
     )
 
     assert matcher.match("w1")["id"] == 1
+
+
+def test_song_matcher_falls_back_to_name_author_and_counts_index_hits():
+    matcher = Song_Matcher(
+        [{"id": "w1", "name": "Song", "artist": "Artist", "ccli": None, "key": "G"}],
+        [
+            {"id": 1, "name": "Song", "author": "Artist", "ccli": "1", "arrangements": [], "category": {}},
+            {"id": 2, "name": "Song", "author": "Artist", "ccli": "2", "arrangements": [], "category": {}},
+        ],
+    )
+
+    assert matcher.match("w1")["id"] == 1
+    assert matcher.lookup_stats() == {"wt:id": 1, "ct:name+author": 1}
+
+
+def test_song_matcher_indexes_added_ct_songs():
+    matcher = Song_Matcher([{"id": "w1", "name": "Song", "artist": "Artist", "ccli": "123", "key": "G"}], [])
+
+    assert matcher.match("w1") is None
+
+    matcher.add_ct_song({"id": 5, "name": "Song", "author": "Artist", "ccli": "123", "arrangements": [], "category": {}})
+
+    assert matcher.match("w1")["id"] == 5
+
+
+def test_match_by_time_joins_across_timezones_and_multiple_times():
+    matcher = Event_Matcher("Europe/Berlin", "America/New_York", config([]))
+    wt_events = [
+        {**wt_event("2026-01-04T18:00"), "id": "w0"},
+        {**wt_event("2026-01-04T08:00"), "times": ["2026-01-03T10:30", "2026-01-04T10:30"], "id": "w1"},
+    ]
+    ct_events = [ct_event(start="2026-01-04T09:30:00Z"), ct_event(start="2026-01-05T09:30:00Z")]
+
+    matches = matcher.match_by_time(wt_events, ct_events)
+
+    assert [(m["ct"]["startDate"], m["wt"]["id"]) for m in matches] == [("2026-01-04T09:30:00Z", "w1")]
+    assert matches[0]["time"].isoformat() == "2026-01-04T04:30:00-05:00"
+
+
+def test_classifier_keeps_first_match_order_within_campus_bucket():
+    matcher = Event_Matcher(
+        "Europe/Berlin",
+        "Europe/Berlin",
+        config(
+            [
+                {"name": "A-only", "campus_name": "Campus A", "regex": "Gottesdienst", "song_placements": []},
+                {"name": "Gottesdienst", "campus_name": None, "regex": None, "song_placements": []},
+                {"name": "B-only", "campus_name": "Campus B", "regex": "Gottesdienst", "song_placements": []},
+            ]
+        ),
+    )
+
+    assert matcher.classify(ct_event(campus="Campus A"))["name"] == "A-only"
+    assert matcher.classify(ct_event(campus="Campus B"))["name"] == "Gottesdienst"
+    assert matcher.classify(ct_event(campus="Campus C"))["name"] == "Gottesdienst"
+    assert matcher.classify(ct_event(name="Jugend", campus="Campus C")) is None
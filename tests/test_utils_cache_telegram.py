@@ -2,9 +2,11 @@ from datetime import datetime, timedelta, timezone
 
 import pytest
 
+import cache
 import telegram
-from cache import Cacher, YamlDatabase
-from utils import slice_list
+from cache import Cacher, Song_Library_Cacher, SqliteDatabase, YamlDatabase, migrate_yaml_to_sqlite
+import utils
+from utils import iter_prefetched, slice_list
 
 
 def test_slice_list_supports_common_slice_forms():
@@ -47,7 +49,7 @@ def test_telegram_returns_when_credentials_missing(monkeypatch):
         nonlocal called
         called = True
 
-    monkeypatch.setattr(telegram.requests, "post", post)
+    monkeypatch.setattr(telegram.session, "post", post)
 
     telegram.send_telegram_message("message")
 
@@ -67,8 +69,204 @@ def test_telegram_uses_timeout(monkeypatch):
 
         return Response()
 
-    monkeypatch.setattr(telegram.requests, "post", post)
+    monkeypatch.setattr(telegram.session, "post", post)
 
     telegram.send_telegram_message("message")
 
     assert calls[0][1]["timeout"] == telegram.REQUEST_TIMEOUT
+
+
+def test_write_behind_database_loads_once_and_flushes_atomically(tmp_path, monkeypatch):
+    db_path = tmp_path / "db.yaml"
+    db_path.write_text("cache: []\n")
+    db = YamlDatabase(str(db_path), write_behind=True)
+    reads = []
+    read_file = db._read_file
+    monkeypatch.setattr(db, "_read_file", lambda: reads.append(1) or read_file())
+
+    db.insert("key", "value")
+    assert db.get("key") == "value"
+    assert db.get("cache") == []
+    assert db_path.read_text() == "cache: []\n"
+
+    db.flush()
+
+    assert len(reads) == 1
+    assert YamlDatabase(str(db_path)).get("key") == "value"
+    assert [path.name for path in tmp_path.iterdir()] == ["db.yaml"]
+
+
+def test_yaml_database_keeps_file_mode_on_atomic_write(tmp_path):
+    db_path = tmp_path / "db.yaml"
+    db = YamlDatabase(str(db_path))
+    db.insert("key", "value")
+    assert db_path.stat().st_mode & 0o777 == 0o666 & ~cache._UMASK
+
+    db_path.chmod(0o640)
+    db.insert("key", "other")
+
+    assert db_path.stat().st_mode & 0o777 == 0o640
+    assert db.get("key") == "other"
+
+
+def test_cacher_tracks_synced_hashes_in_memory(tmp_path):
+    db = YamlDatabase(str(tmp_path / "db.yaml"))
+    cacher = Cacher(db)
+    event = {
+        "ct": {"id": 10},
+        "wt": {"id": "w1", "songs": ["s1"]},
+        "config": {"name": "Gottesdienst"},
+        "time": datetime.now(timezone.utc) + timedelta(days=1),
+    }
+
+    assert cacher.is_already_synced(event) is False
+
+    cacher.cache_sync(event)
+
+    assert cacher.is_already_synced(event) is True
+    assert cacher.is_already_synced({**event, "wt": {"id": "w1", "songs": ["s2"]}}) is False
+    assert Cacher(YamlDatabase(str(tmp_path / "db.yaml"))).is_already_synced(event) is True
+
+    # Im Daemon läuft derselbe Cacher weiter, vergangene Events fallen auch aus dem Speicher
+    past_event = {**event, "ct": {"id": 11}, "time": datetime.now(timezone.utc) - timedelta(minutes=1)}
+    cacher.cache_sync(past_event)
+    cacher.clean_cache()
+    assert list(cacher.hashes) == [cacher._create_hash(event)]
+
+
+def test_sqlite_cache_cleaning_and_yaml_migration(tmp_path):
+    future = datetime.now(timezone.utc) + timedelta(days=1)
+    past = datetime.now(timezone.utc) - timedelta(days=1)
+    yaml_db = YamlDatabase(str(tmp_path / "db.yaml"))
+    yaml_db.insert(
+        "cache",
+        [
+            {"event_datetime": past.isoformat(), "hash": "past", "last_sync": past},
+            {"event_datetime": future.isoformat(), "hash": "future", "last_sync": future},
+        ],
+    )
+    yaml_db.insert("other", {"a": 1})
+    sqlite_db = SqliteDatabase(str(tmp_path / "db.sqlite"))
+
+    migrate_yaml_to_sqlite(yaml_db, sqlite_db)
+    cacher = Cacher(sqlite_db)
+
+    assert [entry["hash"] for entry in sqlite_db.get_cache_entries()] == ["future"]
+    assert set(cacher.hashes) == {"future"}
+    assert sqlite_db.get("other") == {"a": 1}
+    assert sqlite_db.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    # Weitere Aufrufe (z.B. --migrate-from bei jedem Cron-Lauf) überschreiben den neueren SQLite Stand nicht
+    sqlite_db.insert("other", {"a": 2})
+    migrate_yaml_to_sqlite(yaml_db, sqlite_db)
+    assert sqlite_db.get("other") == {"a": 2}
+
+
+def test_sqlite_database_refuses_yaml_files(tmp_path):
+    YamlDatabase(str(tmp_path / "state.db")).insert("cache", [])
+    content = (tmp_path / "state.db").read_text()
+
+    with pytest.raises(ValueError, match="keine SQLite"):
+        SqliteDatabase(str(tmp_path / "state.db"))
+    with pytest.raises(ValueError, match="YAML"):
+        SqliteDatabase(str(tmp_path / "db.yaml"))
+
+    assert (tmp_path / "state.db").read_text() == content
+    assert not (tmp_path / "db.yaml").exists()
+
+
+def test_read_only_databases_keep_changes_in_memory(tmp_path):
+    past = datetime.now(timezone.utc) - timedelta(days=1)
+    entry = {"event_datetime": past.isoformat(), "hash": "past", "last_sync": past.isoformat()}
+    yaml_path = tmp_path / "db.yaml"
+    YamlDatabase(str(yaml_path)).insert("cache", [entry])
+    sqlite_path = tmp_path / "db.sqlite"
+    SqliteDatabase(str(sqlite_path)).add_cache_entry(entry)
+    yaml_content = yaml_path.read_text()
+
+    read_only_dbs = [
+        YamlDatabase(str(yaml_path), write_behind=True, read_only=True),
+        SqliteDatabase(str(sqlite_path), read_only=True),
+    ]
+    for db in read_only_dbs:
+        Cacher(db)
+        db.insert("auth_tokens", {"a": 1})
+        db.flush()
+        assert db.get_cache_entries() == []
+        assert db.get("auth_tokens") == {"a": 1}
+
+    assert yaml_path.read_text() == yaml_content
+    assert [e["hash"] for e in SqliteDatabase(str(sqlite_path)).get_cache_entries()] == ["past"]
+    assert SqliteDatabase(str(sqlite_path)).get("auth_tokens") is None
+    assert SqliteDatabase(str(tmp_path / "missing.sqlite"), read_only=True).get_cache_entries() == []
+    assert not (tmp_path / "missing.sqlite").exists()
+
+
+def test_iter_prefetched_keeps_order_and_limits_look_ahead(monkeypatch):
+    started = []
+    executors = []
+
+    class Executor(utils.ThreadPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.shut_down = False
+            executors.append(self)
+
+        def shutdown(self, *args, **kwargs):
+            self.shut_down = True
+            super().shutdown(*args, **kwargs)
+
+    def fetch(value):
+        started.append(value)
+        return value * 2
+
+    monkeypatch.setattr(utils, "ThreadPoolExecutor", Executor)
+    results = iter_prefetched(fetch, range(5), prefetch=2)
+    iter_prefetched(fetch, range(5), prefetch=2).close()
+    assert executors == []
+
+    assert next(results) == 0
+    assert len(started) <= 3
+    assert list(results) == [2, 4, 6, 8]
+
+    results = iter_prefetched(fetch, range(5), prefetch=2)
+    next(results)
+    results.close()
+    assert [executor.shut_down for executor in executors] == [True, True]
+
+
+def test_song_library_cacher_reuses_catalog_while_count_is_unchanged(tmp_path):
+    class Api:
+        max_workers = 4
+
+        def __init__(self, total):
+            self.total = total
+            self.full_fetches = 0
+            self.prefetch = None
+
+        def get(self, endpoint, params=None):
+            return {"meta": {"pagination": {"total": self.total}}}
+
+        def iter_all(self, endpoint, params=None, prefetch=1):
+            self.full_fetches += 1
+            self.prefetch = prefetch
+            for i in range(self.total):
+                yield {"id": i, "name": "Song", "author": "A", "ccli": str(i), "arrangements": [{"id": 10 + i}], "category": {}}
+
+    class Matcher:
+        pass
+
+    db = YamlDatabase(str(tmp_path / "db.yaml"))
+    api = Api(total=2)
+    library = Song_Library_Cacher(db, timedelta(hours=24))
+    Matcher.ct_songs = list(library.ct_songs(api))
+    library.save(Matcher)
+    assert api.prefetch == Api.max_workers
+
+    cached = Song_Library_Cacher(db, timedelta(hours=24)).ct_songs(api)
+    assert api.full_fetches == 1
+    assert cached[1] == {"id": 1, "name": "Song", "author": "A", "ccli": "1", "arrangements": [{"id": 11}]}
+
+    api.total = 3
+    assert len(list(Song_Library_Cacher(db, timedelta(hours=24)).ct_songs(api))) == 3
+    assert api.full_fetches == 2
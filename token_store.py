@@ -0,0 +1,76 @@
+import base64
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import threading
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from cache import Database
+
+
+class Token_Store:
+    tokens_key = "auth_tokens"
+    # Gültigkeit, falls ein Token selbst kein Ablaufdatum enthält
+    default_lifetime = timedelta(hours=12)
+    # Tokens, die in Kürze ablaufen, werden nicht mehr verwendet
+    expiry_margin = timedelta(minutes=5)
+
+    def __init__(self, db: "Database", secret: Optional[str] = None):
+        """
+        Speichert Login-Tokens mit Ablaufdatum im Sync-State, damit sie über mehrere Läufe wiederverwendet werden.
+
+        :param db: Der Sync-State Speicher.
+        :param secret: Optionaler Fernet-Schlüssel (SYNC_STATE_KEY), mit dem die Tokens verschlüsselt abgelegt werden.
+            Benötigt das Paket cryptography.
+        """
+        self.db = db
+        self.fernet = None
+        self._lock = threading.Lock()
+        if secret:
+            try:
+                from cryptography.fernet import Fernet
+            except ImportError as e:
+                raise RuntimeError("SYNC_STATE_KEY benötigt das Paket cryptography (pip install cryptography)") from e
+            self.fernet = Fernet(secret)
+
+    def get(self, name: str) -> str | None:
+        """Liefert das gespeicherte Token, sofern es noch gültig ist."""
+        entry = (self.db.get(self.tokens_key) or {}).get(name)
+        if not entry:
+            return None
+        if datetime.fromisoformat(entry["expires_at"]) - self.expiry_margin <= datetime.now(timezone.utc):
+            return None
+        if entry.get("encrypted"):
+            if not self.fernet:
+                logging.warning(f"Token {name} ist verschlüsselt gespeichert, aber SYNC_STATE_KEY ist nicht gesetzt")
+                return None
+            return self.fernet.decrypt(entry["token"].encode()).decode()
+        return entry["token"]
+
+    def save(self, name: str, token: str, expires_at: datetime | None = None) -> None:
+        expires_at = expires_at or self.token_expiry(token)
+        entry = {"expires_at": expires_at.isoformat(), "encrypted": self.fernet is not None}
+        entry["token"] = self.fernet.encrypt(token.encode()).decode() if self.fernet else token
+        with self._lock:
+            if not self.fernet:
+                # Unverschlüsselte Tokens: die DB Datei darf nur noch der Besitzer lesen
+                self.db.restrict_access()
+            tokens = dict(self.db.get(self.tokens_key) or {})
+            tokens[name] = entry
+            self.db.insert(self.tokens_key, tokens)
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            tokens = dict(self.db.get(self.tokens_key) or {})
+            if tokens.pop(name, None):
+                self.db.insert(self.tokens_key, tokens)
+
+    def token_expiry(self, token: str) -> datetime:
+        """Liest das Ablaufdatum (exp) aus einem JWT, sonst gilt default_lifetime."""
+        try:
+            payload = token.split(".")[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            return datetime.fromtimestamp(int(claims["exp"]), timezone.utc)
+        except (IndexError, KeyError, TypeError, ValueError):
+            return datetime.now(timezone.utc) + self.default_lifetime
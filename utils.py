@@ -1,7 +1,11 @@
-from typing import TypeVar
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, TypeVar
 from datetime import datetime
 
 T = TypeVar("T")
+A = TypeVar("A")
 
 
 def slice_list(input_list: list[T], slice_str: str):
@@ -47,3 +51,28 @@ def parse_datetime(datetime_str: str, formats: list[str]) -> datetime:
         except ValueError:
             continue
     raise ValueError(f"Time data '{datetime_str}' does not match any format in {formats}")
+
+
+def iter_prefetched(fetch: Callable[[A], T], args: Iterable[A], prefetch: int = 1) -> Iterator[T]:
+    """
+    Ruft fetch für alle args in einem Thread-Pool auf und liefert die Ergebnisse in Reihenfolge.
+
+    :param fetch: Funktion, die für jedes Argument aufgerufen wird (z.B. eine Seite laden).
+    :param args: Die Argumente in der gewünschten Reihenfolge.
+    :param prefetch: Wie viele Aufrufe dem Verbraucher maximal vorauslaufen. Die ersten starten beim ersten Abruf,
+        erst dann wird der Thread-Pool angelegt. Er wird beendet, sobald der Iterator erschöpft oder geschlossen ist.
+    :return: Ein Iterator über die Ergebnisse.
+    """
+    args_iter = iter(args)
+    executor = ThreadPoolExecutor(max_workers=max(1, prefetch))
+    pending: deque[Future[T]] = deque()
+    try:
+        pending.extend(executor.submit(fetch, arg) for arg in islice(args_iter, max(1, prefetch)))
+        while pending:
+            result = pending.popleft().result()
+            pending.extend(executor.submit(fetch, arg) for arg in islice(args_iter, 1))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
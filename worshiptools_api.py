@@ -1,7 +1,14 @@
+from datetime import date
+from itertools import chain
 import logging
-import requests
+import threading
 import urllib.parse
 
+from custom_types import WT_Event
+from http_client import Http_Response_Cache, Retry_Policy, create_session, default_rate_limiter
+from token_store import Token_Store
+from utils import iter_prefetched
+
 
 REQUEST_TIMEOUT = 30
 
@@ -11,13 +18,44 @@ class WorshiptoolsApiError(Exception):
 
 
 class Worshiptools_API:
-    def __init__(self, email, password, account_id):
+    max_workers = 4
+    max_pagination_attempts = 3
+    app_url = "https://planning.worshiptools.com/app"
+    login_url = "https://auth.worshiptools.com/login"
+    api_url = "https://api.worship.tools/v1"
+    # Namen der Datumsfilter des service Endpunkts (nicht offiziell dokumentiert, ungeprüft)
+    service_date_params = ("startDate", "endDate")
+    service_page_size = 50
+    token_store: Token_Store | None = None
+    response_cache: Http_Response_Cache | None = None
+    retry_policy = Retry_Policy()
+    rate_limiter = default_rate_limiter
+    _login_lock = threading.Lock()
+
+    def __init__(
+        self,
+        email,
+        password,
+        account_id,
+        max_workers: int | None = None,
+        token_store: Token_Store | None = None,
+        response_cache: Http_Response_Cache | None = None,
+        app_url: str | None = None,
+        login_url: str | None = None,
+        api_url: str | None = None,
+    ):
+        """app_url, login_url und api_url überschreiben die Worshiptools URLs (z.B. für einen lokalen Mock-Server)."""
         if not email or not password or not account_id:
             raise WorshiptoolsApiError("WORSHIPTOOLS_EMAIL, WORSHIPTOOLS_PASSWORD, and WORSHIPTOOLS_ACCOUNT_ID are required")
         self.email = email
         self.password = password
         self.account_id = account_id
-        self.session = requests.Session()
+        if max_workers is not None:
+            self.max_workers = max_workers
+        self.app_url = app_url or self.app_url
+        self.login_url = login_url or self.login_url
+        self.api_url = api_url or self.api_url
+        self.session = create_session(pool_size=self.max_workers)
         self.session.headers.update(
             {
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:132.0) Gecko/20100101 Firefox/132.0",
@@ -25,63 +63,146 @@ class Worshiptools_API:
                 "Connection": "keep-alive",
             }
         )
-        self.bearer_token = None
-        self._login()
+        self.token_store = token_store
+        self.response_cache = response_cache
+        self.bearer_token = self.token_store.get(self._token_name()) if self.token_store else None
+        if self.bearer_token:
+            logging.info(f"Worshiptools Login als {self.email} aus gespeichertem Token")
+        else:
+            self._login()
 
     def _login(self):
-        initial_url = "https://planning.worshiptools.com/app"
-        response = self.session.get(initial_url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+        response = self.session.get(self.app_url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
         if response.status_code not in [200, 302]:
             raise WorshiptoolsApiError(
                 f"Fehler beim Abrufen von authRequest oder weAuthState: {response.status_code}, {response.text}"
             )
-        login_url = "https://auth.worshiptools.com/login"
         self.session.headers.update({"Content-Type": "application/x-www-form-urlencoded"})
         data = {
             "email": self.email,
             "password": self.password,
         }
-        response = self.session.post(login_url, data=data, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+        response = self.session.post(self.login_url, data=data, allow_redirects=True, timeout=REQUEST_TIMEOUT)
         if response.status_code not in [200, 302]:
             raise WorshiptoolsApiError(f"Fehler beim Login: {response.status_code}, {response.text}")
         self.bearer_token = self.session.cookies.get("weAuthToken")
         if not self.bearer_token:
             raise WorshiptoolsApiError("Worshiptools login did not return a bearer token")
         logging.info(f"Worshiptools Login Successful as {self.email}")
+        if self.token_store:
+            self.token_store.save(self._token_name(), self.bearer_token)
+
+    def _token_name(self):
+        return f"worshiptools:{self.email}"
+
+    def _api_headers(self, bearer_token: str):
+        return {
+            "Authorization": f"Bearer {bearer_token}",
+            "Content-Type": "application/json",
+            "Origin": self._origin(),
+        }
+
+    def _origin(self):
+        app_url = urllib.parse.urlsplit(self.app_url)
+        return f"{app_url.scheme}://{app_url.netloc}"
+
+    def _send(self, api_url: str, bearer_token: str, headers: dict[str, str] | None = None):
+        def send():
+            return self.session.get(
+                api_url, headers={**self._api_headers(bearer_token), **(headers or {})}, timeout=REQUEST_TIMEOUT
+            )
+
+        return self.retry_policy.send("get", api_url, send, self.rate_limiter)
+
+    def _relogin(self, expired_token: str | None):
+        with self._login_lock:
+            # Parallele Anfragen mit demselben abgelaufenen Token lösen nur einen Login aus
+            if self.bearer_token == expired_token:
+                logging.info("Worshiptools Token abgelaufen, melde neu an")
+                self._login()
 
     def get(self, endpoint: str, params: dict | None = None):
         params = params or {}
         params_str = ""
         if params:
             params_str = "?" + urllib.parse.urlencode(params)
-        api_url = f"https://api.worship.tools/v1/account/{self.account_id}/{endpoint}{params_str}"
+        api_url = f"{self.api_url}/account/{self.account_id}/{endpoint}{params_str}"
         logging.info(f"GET {api_url}")
-        self.session.headers.update(
-            {
-                "Authorization": f"Bearer {self.bearer_token}",
-                "Content-Type": "application/json",
-                "Origin": "https://planning.worshiptools.com",
-            }
-        )
-        response = self.session.get(api_url, timeout=REQUEST_TIMEOUT)
+        if self.response_cache:
+            response = self.response_cache.fetch(api_url, lambda headers: self._request(api_url, headers))
+        else:
+            response = self._request(api_url)
         if response.status_code == 200:
             return response.json().get("response")
         logging.error(f"Fehler bei der API-Anfrage: {response.status_code}, {response.text}")
         return None
 
+    def _request(self, api_url: str, headers: dict[str, str] | None = None):
+        bearer_token = self.bearer_token
+        response = self._send(api_url, bearer_token, headers)
+        if response.status_code == 401:
+            self._relogin(bearer_token)
+            response = self._send(api_url, self.bearer_token, headers)
+        return response
+
     def get_all(self, endpoint: str, params: dict | None = None):
+        """Lädt alle Seiten eines paginierten Endpunkts, die Seiten nach der ersten parallel (max_workers)."""
+        return {"docs": list(self.iter_all(endpoint, params, prefetch=self.max_workers))}
+
+    def get_services(self, start: date, end: date) -> list[WT_Event]:
+        """Alle Services mit einem Termin von start bis end (jeweils inklusive).
+        Falls Worshiptools die Datumsparameter ignoriert, wird zusätzlich lokal gefiltert und nicht weiter geblättert,
+        sobald nach den ersten Treffern eine ganze Seite außerhalb des Zeitraums liegt (auf- wie absteigend sortiert).
+        """
+        params = dict(zip(self.service_date_params, (start.isoformat(), end.isoformat())))
+        params["rows"] = self.service_page_size
+        first_day, last_day = start.isoformat(), end.isoformat()
+        services: list[WT_Event] = []
+        outside_in_a_row = 0
+        for service in self.iter_all("service", params):
+            if any(first_day <= time[:10] <= last_day for time in service.get("times", [])):
+                services.append(service)
+                outside_in_a_row = 0
+                continue
+            outside_in_a_row = outside_in_a_row + 1
+            if services and outside_in_a_row >= self.service_page_size:
+                break
+        return services
+
+    def iter_all(self, endpoint: str, params: dict | None = None, prefetch: int = 1):
+        """Liefert die Einträge eines paginierten Endpunkts Seite für Seite.
+        Nach der ersten Seite ist numFound bekannt, bis zu `prefetch` weitere Offsets werden im Hintergrund geladen.
+        Ändert sich numFound zwischendurch, wird der gesamte Bereich erneut angefragt; bereits gelieferte
+        Einträge (gleiche id) werden dabei übersprungen.
+        """
         params = dict(params or {})
-        current_num = 0
-        total_num = 1
-        data = []
-        while current_num < total_num:
-            params.update({"start": current_num})
-            res = self.get(endpoint, params)
-            if not res:
-                raise WorshiptoolsApiError("Fehler bei Anfrage an Worshiptools API")
-            if "numFound" not in res or "docs" not in res:
-                raise WorshiptoolsApiError(f"Worshiptools API response missing pagination metadata for {endpoint}")
-            total_num = res["numFound"]
-            data = data + res["docs"]
-            current_num = len(data)
-        return {"docs": data}
+        yielded_ids = set()
+        for _ in range(self.max_pagination_attempts):
+            first_page = self._get_page(endpoint, params, 0)
+            total_num = first_page["numFound"]
+            page_size = len(first_page["docs"])
+            offsets = range(page_size, total_num, page_size) if page_size else range(0)
+            pages = iter_prefetched(lambda start: self._get_page(endpoint, params, start), offsets, prefetch)
+            consistent = True
+            for res in chain([first_page], pages):
+                if res["numFound"] != total_num:
+                    consistent = False
+                    pages.close()
+                    break
+                for doc in res["docs"]:
+                    doc_id = doc.get("id")
+                    if doc_id is None or doc_id not in yielded_ids:
+                        yielded_ids.add(doc_id)
+                        yield doc
+            if consistent:
+                return
+            logging.warning(f"numFound für {endpoint} hat sich während der Pagination geändert, lade erneut")
+        raise WorshiptoolsApiError(f"Worshiptools API pagination for {endpoint} did not settle")
+
+    def _get_page(self, endpoint: str, params: dict, start: int):
+        res = self.get(endpoint, {**params, "start": start})
+        if not res:
+            raise WorshiptoolsApiError("Fehler bei Anfrage an Worshiptools API")
+        if "numFound" not in res or "docs" not in res:
+            raise WorshiptoolsApiError(f"Worshiptools API response missing pagination metadata for {endpoint}")
+        return res